@@ -8,9 +8,15 @@
     'depends': ['base','mail'],
     'data': [
         'security/ir.model.access.csv',
-        # 'view/storage_management_view.xml',
-        
+        'data/ir_cron.xml',
     ],
+    'assets': {
+        'web.assets_backend': [
+            'saas_user_limit/static/src/css/storage_quota_banner.css',
+            'saas_user_limit/static/src/js/storage_quota_banner.js',
+            'saas_user_limit/static/src/js/saas_write_guard.js',
+        ],
+    },
     'auto_install': False,  # تم تغيير التثبيت يدوى مؤقت لحين الانتهاء اً
     'installable': True,
     'application': False,
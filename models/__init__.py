@@ -1,4 +1,11 @@
+from . import saas_metrics
+from . import saas_rate_limit
 from . import user_limit_control
+from . import user_limit_tier
+from . import saas_usage_history
+from . import storage_breakdown
 from . import res_user
 from . import saas_auto_login_client
-# from . import storage_management
+from . import saas_client_token_manager
+from . import ir_http
+from . import storage_management
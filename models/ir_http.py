@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from odoo import models, _
+from odoo.http import request
+from werkzeug.exceptions import RequestEntityTooLarge
+from .saas_metrics import STORAGE_QUOTA_CHECKS
+
+# مسارات رفع الملفات التي يتم فحصها قبل قراءة الـ body
+UPLOAD_ROUTES = frozenset([
+    '/web/binary/upload_attachment',
+    '/mail/attachment/upload',
+    '/html_editor/attachment/add_data',
+    '/web_editor/attachment/add_data',
+])
+
+
+class QuotaLimitedInput:
+    """
+    غلاف لـ wsgi.input: 413 بمجرد قراءة أكثر من limit بايت
+    يشمل الـ bodies بدون Content-Length (chunked) والتي تعلن حجماً أقل من الحقيقي
+    """
+
+    def __init__(self, stream, limit):
+        self._stream = stream
+        self._limit = limit
+        self._consumed = 0
+
+    def _count(self, data):
+        self._consumed += len(data)
+        if self._consumed > self._limit:
+            STORAGE_QUOTA_CHECKS.inc(model='http.upload', result='blocked')
+            raise RequestEntityTooLarge(_(
+                "⛔ FILE UPLOAD BLOCKED\n\n"
+                "This upload exceeds the remaining storage quota (%(remaining)s bytes).\n"
+                "Delete unnecessary files or contact administrator to upgrade storage plan.",
+                remaining=self._limit,
+            ))
+        return data
+
+    def read(self, size=-1):
+        return self._count(self._stream.read() if size is None or size < 0 else self._stream.read(size))
+
+    def readline(self, size=-1):
+        return self._count(self._stream.readline() if size is None or size < 0 else self._stream.readline(size))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def close(self):
+        close = getattr(self._stream, 'close', None)
+        if close:
+            close()
+
+
+class IrHttp(models.AbstractModel):
+    """
+    إضافة حالة حد المستخدمين وحالة التخزين (read-only) إلى session_info
+    حتى تمنع الواجهة العمليات المرفوضة بدون طلب للسيرفر
+    """
+    _inherit = 'ir.http'
+
+    def session_info(self):
+        result = super().session_info()
+        result.update(self.env['ir.config_parameter'].sudo()._get_storage_state())
+        if self.env.user.has_group('base.group_erp_manager'):
+            result['saas_user_limit'] = self.env['saas.user.limit.control'].sudo()._get_user_limit_state()
+        return result
+
+    @classmethod
+    def _pre_dispatch(cls, rule, args):
+        """
+        Reject uploads larger than the remaining quota before the body is parsed:
+        - declared Content-Length over the quota => 413 right away
+        - wsgi.input is wrapped to cut chunked / under-declared bodies mid-stream
+        """
+        super()._pre_dispatch(rule, args)
+
+        if rule.rule not in UPLOAD_ROUTES or not request.env:
+            return
+        env = request.env
+        if env['ir.attachment']._storage_quota_bypassed():
+            return
+
+        remaining = env['ir.config_parameter'].sudo()._get_storage_remaining()
+        if remaining is None:
+            return
+
+        httprequest = request.httprequest
+        content_length = httprequest.content_length
+        if content_length is not None and content_length > remaining:
+            STORAGE_QUOTA_CHECKS.inc(model='http.upload', result='blocked')
+            raise RequestEntityTooLarge(_(
+                "⛔ FILE UPLOAD BLOCKED\n\n"
+                "This upload (%(size)s bytes) exceeds the remaining storage quota (%(remaining)s bytes).\n"
+                "Delete unnecessary files or contact administrator to upgrade storage plan.",
+                size=content_length, remaining=remaining,
+            ))
+
+        # الـ body لم يُقرأ بعد (يُقرأ عند تجهيز params في الـ dispatcher)
+        environ = httprequest.environ
+        environ['wsgi.input'] = QuotaLimitedInput(environ['wsgi.input'], remaining)
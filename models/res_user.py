@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 from odoo import models, api, _
 from odoo.exceptions import ValidationError
+from .saas_metrics import USER_LIMIT_CHECKS, USER_LIMIT_CHECK_SECONDS
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# الحقول التي قد تغيّر انتماء المستخدم لشرائح الترخيص
+TIER_FIELDS = ('groups_id', 'active', 'share')
+TIER_FIELD_PREFIXES = ('in_group_', 'sel_groups_')
+
 
 class ResUsers(models.Model):
     """
@@ -20,70 +25,214 @@ class ResUsers(models.Model):
         """
         # فحص عدد المستخدمين الداخليين الجدد فقط
         internal_users_count = 0
+        added_by_company = {}
         for vals in vals_list:
             # التحقق من أن المستخدم ليس shared user
             if not vals.get('share', False):
                 internal_users_count += 1
+                company_id = vals.get('company_id') or self.env.company.id
+                added_by_company[company_id] = added_by_company.get(company_id, 0) + 1
 
         # إذا كان هناك مستخدمين داخليين جدد، نفحص الحد
+        current_count = None
         if internal_users_count > 0:
-            limit_control = self.env['saas.user.limit.control'].sudo().search([], limit=1)
-
-            if limit_control:
-                current_count = self.search_count([
-                    ('share', '=', False),
-                    ('active', '=', True)
-                ])
-
-                new_total = current_count + internal_users_count
-
-                if new_total > limit_control.max_users:
-                    raise ValidationError(_(
-                        '🚫 Cannot Create User - Limit Reached!\n\n'
-                        '📊 User Limit Summary:\n'
-                        '━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n'
-                        'Maximum Allowed Users: %s\n'
-                        'Current Active Users: %s\n'
-                        'Trying to Add: %s user(s)\n'
-                        'Would Result In: %s users\n\n'
-                        '💡 Solution:\n'
-                        'Contact your system administrator to increase the user limit.\n'
-                    ) % (
-                                              limit_control.max_users,
-                                              current_count,
-                                              internal_users_count,
-                                              new_total
-                                          ))
-
-                _logger.info(
-                    "✅ User creation allowed: %s/%s users",
-                    new_total,
-                    limit_control.max_users
-                )
-
-        return super().create(vals_list)
+            with USER_LIMIT_CHECK_SECONDS.time(operation='create'):
+                current_count = self._check_user_limit_on_create(internal_users_count, added_by_company)
+
+        users = super().create(vals_list)
+
+        # فحص حدود الشرائح بعد الإنشاء (المجموعات الافتراضية تُضاف أثناء create)
+        internal_users = users.filtered(lambda u: not u.share)
+        if internal_users:
+            with USER_LIMIT_CHECK_SECONDS.time(operation='tier'):
+                self._check_tier_limits(internal_users)
+            # المستخدمون المنشؤون غير نشطين لا يُحتسبون (مثل استعلام العد)
+            self._record_user_usage(
+                None if current_count is None else current_count + len(internal_users.filtered('active'))
+            )
+
+        return users
+
+    @api.model
+    def _check_user_limit_on_create(self, internal_users_count, added_by_company):
+        """
+        فحص الحد الأقصى لعدد المستخدمين الداخليين الجدد (قاعدة البيانات ثم الشركات)
+
+        :return: عدد المستخدمين الداخليين الحالي (قبل الإنشاء) أو None إذا لم يتم عده
+        """
+        LimitControl = self.env['saas.user.limit.control'].sudo()
+        try:
+            LimitControl._check_company_limits(added_by_company=added_by_company)
+        except ValidationError:
+            USER_LIMIT_CHECKS.inc(operation='create', result='rejected')
+            raise
+
+        limit_control = LimitControl._get_database_limit()
+
+        if limit_control:
+            current_count = self.search_count([
+                ('share', '=', False),
+                ('active', '=', True)
+            ])
+
+            new_total = current_count + internal_users_count
+
+            if new_total > limit_control.max_users:
+                USER_LIMIT_CHECKS.inc(operation='create', result='rejected')
+                raise ValidationError(_(
+                    '🚫 Cannot Create User - Limit Reached!\n\n'
+                    '📊 User Limit Summary:\n'
+                    '━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n'
+                    'Maximum Allowed Users: %s\n'
+                    'Current Active Users: %s\n'
+                    'Trying to Add: %s user(s)\n'
+                    'Would Result In: %s users\n\n'
+                    '💡 Solution:\n'
+                    'Contact your system administrator to increase the user limit.\n'
+                ) % (
+                                          limit_control.max_users,
+                                          current_count,
+                                          internal_users_count,
+                                          new_total
+                                      ))
+
+            USER_LIMIT_CHECKS.inc(operation='create', result='allowed')
+            _logger.debug(
+                "✅ User creation allowed: %s/%s users",
+                new_total,
+                limit_control.max_users
+            )
+            return current_count
+
+        return None
 
     def write(self, vals):
         """
         منع تحويل shared user إلى internal user إذا تجاوز الحد
         """
+        # عضويات الشرائح قبل التعديل: الفحص يتم فقط للشرائح التي زاد عددها
+        tier_change = any(field in TIER_FIELDS or field.startswith(TIER_FIELD_PREFIXES) for field in vals)
+        tier_memberships = None
+        if tier_change:
+            tier_memberships = self.env['saas.user.limit.tier'].sudo()._get_tier_memberships(self)
+
+        # شركات المستخدمين المحتسبين قبل التعديل: الفحص يتم فقط للشركات التي زاد عددها
+        company_change = 'company_id' in vals or 'active' in vals or 'share' in vals
+        companies_before = None
+        if company_change:
+            companies_before = {
+                user.id: user.company_id.id for user in self.filtered(lambda u: u.active and not u.share)
+            }
+
         result = super().write(vals)
 
         # إذا تم تغيير share من True إلى False
+        current_count = None
         if 'share' in vals and not vals['share']:
-            limit_control = self.env['saas.user.limit.control'].sudo().search([], limit=1)
-
-            if limit_control:
-                current_count = self.search_count([
-                    ('share', '=', False),
-                    ('active', '=', True)
-                ])
-
-                if current_count > limit_control.max_users:
-                    raise ValidationError(_(
-                        '🚫 Cannot Convert to Internal User!\n\n'
-                        'Current internal users (%s) would exceed the limit (%s).\n'
-                        'Please contact your administrator.'
-                    ) % (current_count, limit_control.max_users))
-
-        return result
\ No newline at end of file
+            with USER_LIMIT_CHECK_SECONDS.time(operation='write'):
+                current_count = self._check_user_limit_on_write()
+
+        # نقل مستخدمين لشركة أخرى أو إعادة تفعيلهم / تحويلهم إلى internal
+        if company_change:
+            with USER_LIMIT_CHECK_SECONDS.time(operation='company'):
+                self._check_company_limits_on_write(companies_before)
+
+        if tier_change:
+            with USER_LIMIT_CHECK_SECONDS.time(operation='tier'):
+                self._check_tier_limits(self, tier_memberships)
+
+        if 'share' in vals or 'active' in vals:
+            self._record_user_usage(current_count)
+
+        return result
+
+    def unlink(self):
+        """تسجيل عدد المستخدمين بعد الحذف"""
+        result = super().unlink()
+        self._record_user_usage()
+        return result
+
+    def _record_user_usage(self, count=None):
+        """
+        تسجيل عدد المستخدمين الداخليين في سجل الاستهلاك (saas.usage.daily)
+        وإرسال الحالة الجديدة للواجهة إذا تغيّر العدد
+        """
+        if count is None:
+            count = self.sudo().search_count([
+                ('share', '=', False),
+                ('active', '=', True)
+            ])
+        if self.env['saas.usage.daily'].sudo()._record_usage('users', count):
+            self.env['saas.user.limit.control'].sudo()._notify_user_limit_state(count)
+
+    def _check_tier_limits(self, users, memberships_before=None):
+        """
+        فحص حدود الشرائح (saas.user.limit.tier)
+
+        :param memberships_before: عضويات الشرائح قبل التعديل - إن وُجدت، يتم فحص
+            الشرائح التي انضم لها المستخدمون فقط (الإلغاء / الإزالة لا يُرفض أبداً)
+        """
+        Tier = self.env['saas.user.limit.tier'].sudo()
+        group_ids = None
+        if memberships_before is not None:
+            group_ids = {group_id for _user_id, group_id in Tier._get_tier_memberships(users) - memberships_before}
+            if not group_ids:
+                return
+        try:
+            Tier._check_tier_limits(users, group_ids)
+        except ValidationError:
+            USER_LIMIT_CHECKS.inc(operation='tier', result='rejected')
+            raise
+        USER_LIMIT_CHECKS.inc(operation='tier', result='allowed')
+
+    def _check_user_limit_on_write(self):
+        """
+        فحص الحد الأقصى بعد تحويل مستخدمين إلى internal
+
+        :return: عدد المستخدمين الداخليين الحالي أو None إذا لم يتم عده
+        """
+        limit_control = self.env['saas.user.limit.control'].sudo()._get_database_limit()
+
+        if limit_control:
+            current_count = self.search_count([
+                ('share', '=', False),
+                ('active', '=', True)
+            ])
+
+            if current_count > limit_control.max_users:
+                USER_LIMIT_CHECKS.inc(operation='write', result='rejected')
+                raise ValidationError(_(
+                    '🚫 Cannot Convert to Internal User!\n\n'
+                    'Current internal users (%s) would exceed the limit (%s).\n'
+                    'Please contact your administrator.'
+                ) % (current_count, limit_control.max_users))
+
+            USER_LIMIT_CHECKS.inc(operation='write', result='allowed')
+            return current_count
+
+        return None
+
+    def _check_company_limits_on_write(self, companies_before=None):
+        """
+        فحص حدود شركات المستخدمين المعدلين - استعلام واحد لكل الشركات
+
+        :param companies_before: {user_id: company_id} للمستخدمين المحتسبين قبل التعديل -
+            يتم فحص الشركات التي انضم لها المستخدمون فقط (حفظ مستخدم بدون تغيير شركته لا يُرفض)
+        """
+        companies_before = companies_before or {}
+        company_ids = {
+            user.company_id.id
+            for user in self.filtered(lambda u: u.active and not u.share)
+            if companies_before.get(user.id) != user.company_id.id
+        }
+        if not company_ids:
+            return
+
+        try:
+            self.env['saas.user.limit.control'].sudo()._check_company_limits(
+                company_ids=list(company_ids)
+            )
+        except ValidationError:
+            USER_LIMIT_CHECKS.inc(operation='company', result='rejected')
+            raise
+        USER_LIMIT_CHECKS.inc(operation='company', result='allowed')
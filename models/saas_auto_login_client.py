@@ -10,17 +10,63 @@ from datetime import datetime, timedelta
 import logging
 import werkzeug
 import json
+import re
+
+from .saas_metrics import TOKEN_OPERATIONS, AggregatedLog
+from .saas_rate_limit import GENERATE_BY_IP, GENERATE_BY_USER, AUTOLOGIN_BY_IP
 
 _logger = logging.getLogger(__name__)
 
 TOKEN_STORAGE = {}
 
+# secrets.token_urlsafe(40) => 54 حرف من [A-Za-z0-9_-]
+TOKEN_FORMAT = re.compile(r'[A-Za-z0-9_-]{54}')
+
+# سطر log واحد مجمّع للـ tokens المرفوضة بدلاً من سطر لكل محاولة
+_rejected_tokens_log = AggregatedLog(_logger, "⚠️ Rejected autologin tokens")
+
+# علامة "تغيّر المستخدم": أحدث write_date للمستخدم أو الـ partner (lang / tz)
+USER_VERSION_QUERY = """
+    SELECT u.active, GREATEST(u.write_date, p.write_date)
+      FROM res_users u
+      JOIN res_partner p ON p.id = u.partner_id
+     WHERE u.id = %s
+"""
+
+REJECTED_TOKEN_PAGE = (
+    '<!DOCTYPE html><html><head><meta charset="utf-8"/></head>'
+    '<body><p>%s</p><p><a href="/web/login">Login</a></p></body></html>'
+)
+
 
 class SaasAutoLoginController(http.Controller):
+
+    def _rate_limited(self, limiter, key, json_response=False):
+        """
+        فحص الـ rate limit قبل أي عمل على الـ ORM
+
+        :return: response 429 إذا تم تجاوز الحد، None خلاف ذلك
+        """
+        # الـ buckets مشتركة بين كل قواعد البيانات على نفس الجهاز (data_dir): المفتاح يشمل القاعدة
+        allowed, retry_after = limiter.hit((request.db, key))
+        if allowed:
+            return None
+
+        headers = [('Retry-After', str(int(retry_after) + 1))]
+        if json_response:
+            return request.make_json_response({
+                'success': False,
+                'error': 'Too many requests'
+            }, headers=headers, status=429)
+        return request.make_response('Too many requests', headers=headers, status=429)
     
     @http.route('/saas/generate_auth_link', type='http', auth='none', methods=['POST'], csrf=False)
     def generate_auth_link(self, **kwargs):
         """توليد رابط تسجيل دخول تلقائي"""
+        rejected = self._rate_limited(GENERATE_BY_IP, request.httprequest.remote_addr, json_response=True)
+        if rejected:
+            return rejected
+
         try:
             # ✅ قراءة البيانات بطريقة صحيحة
             user_id = None
@@ -43,6 +89,7 @@ class SaasAutoLoginController(http.Controller):
                 _logger.info("📥 Data from kwargs: user_id=%s", user_id)
             
             if not user_id or not admin_password:
+                TOKEN_OPERATIONS.inc(operation='mint', result='missing_params')
                 _logger.error("❌ Missing user_id or admin_password")
                 return request.make_json_response({
                     'success': False, 
@@ -50,11 +97,17 @@ class SaasAutoLoginController(http.Controller):
                 })
             
             user_id = int(user_id)
+
+            rejected = self._rate_limited(GENERATE_BY_USER, user_id, json_response=True)
+            if rejected:
+                return rejected
+
             current_db = request.env.cr.dbname
             
             # ✅ التحقق من المستخدم
             user = request.env['res.users'].sudo().browse(user_id)
             if not user.exists():
+                TOKEN_OPERATIONS.inc(operation='mint', result='user_not_found')
                 _logger.error("❌ User ID %d not found", user_id)
                 return request.make_json_response({
                     'success': False, 
@@ -62,6 +115,7 @@ class SaasAutoLoginController(http.Controller):
                 })
             
             if not user.active:
+                TOKEN_OPERATIONS.inc(operation='mint', result='user_inactive')
                 _logger.error("❌ User ID %d is inactive", user_id)
                 return request.make_json_response({
                     'success': False, 
@@ -89,13 +143,21 @@ class SaasAutoLoginController(http.Controller):
             token = secrets.token_urlsafe(40)
             expires = datetime.now() + timedelta(minutes=10)
             
+            # ✅ بيانات الـ session تُحفظ مع الـ token لتجنب قراءة المستخدم عند الاستخدام
+            request.env.cr.execute(USER_VERSION_QUERY, [user_id])
+            user_version = request.env.cr.fetchone()[1]
+
             TOKEN_STORAGE[token] = {
                 'user_id': user_id,
                 'user_login': user.login,
+                'lang': user.lang or 'en_US',
+                'tz': user.tz or 'UTC',
+                'user_version': user_version,
                 'expires': expires,
                 'db_name': current_db
             }
             
+            TOKEN_OPERATIONS.inc(operation='mint', result='success')
             _logger.info("✅ Token generated for user %s (ID: %d)", user.login, user_id)
             
             base = request.httprequest.host_url.rstrip('/')
@@ -109,29 +171,45 @@ class SaasAutoLoginController(http.Controller):
             })
             
         except Exception as e:
+            TOKEN_OPERATIONS.inc(operation='mint', result='error')
             _logger.error("❌ Generate link failed: %s", str(e), exc_info=True)
             return request.make_json_response({
                 'success': False, 
                 'error': str(e)
             })
 
+    def _reject_token(self, reason, status):
+        """رفض token بصفحة ثابتة - بدون render وبدون قاعدة بيانات"""
+        TOKEN_OPERATIONS.inc(operation='consume', result=reason)
+        _rejected_tokens_log.add(reason)
+        return request.make_response(
+            REJECTED_TOKEN_PAGE % 'رمز التسجيل غير صالح',
+            headers=[('Content-Type', 'text/html; charset=utf-8')],
+            status=status,
+        )
+
     @http.route('/saas/autologin', type='http', auth='public', methods=['GET'], csrf=False)
     def autologin(self, token, **kwargs):
         """تسجيل الدخول التلقائي - محدّث لـ Odoo 17"""
+        rejected = self._rate_limited(AUTOLOGIN_BY_IP, request.httprequest.remote_addr)
+        if rejected:
+            return rejected
+
         try:
-            _logger.info("🔑 Autologin attempt with token: %s...", token[:10])
-            
-            # ✅ التحقق من Token
-            data = TOKEN_STORAGE.get(token)
-            
+            # ✅ Pre-filter: رفض الـ tokens المشوهة أو غير المعروفة قبل أي عمل آخر
+            if not TOKEN_FORMAT.fullmatch(token):
+                return self._reject_token('invalid_format', 400)
+
+            # ✅ حذف الـ token فوراً (single-use): pop عملية atomic داخل الـ worker
+            data = TOKEN_STORAGE.pop(token, None)
+
             if not data:
-                _logger.warning("⚠️ Token not found")
-                return request.render('web.login', {
-                    'error': 'رمز التسجيل غير صالح'
-                })
+                return self._reject_token('not_found', 404)
+
+            _logger.info("🔑 Autologin attempt with token: %s...", token[:10])
             
             if datetime.now() > data['expires']:
-                del TOKEN_STORAGE[token]
+                TOKEN_OPERATIONS.inc(operation='consume', result='expired')
                 _logger.warning("⚠️ Token expired")
                 return request.render('web.login', {
                     'error': 'انتهت صلاحية رمز التسجيل'
@@ -141,18 +219,21 @@ class SaasAutoLoginController(http.Controller):
             user_login = data['user_login']
             db_name = data['db_name']
             
-            # ✅ التحقق من المستخدم مرة أخرى
-            user = request.env['res.users'].sudo().browse(user_id)
-            if not user.exists() or not user.active:
-                del TOKEN_STORAGE[token]
+            # ✅ التحقق من المستخدم مرة أخرى - استعلام خفيف بدل قراءة السجل كاملاً
+            request.env.cr.execute(USER_VERSION_QUERY, [user_id])
+            row = request.env.cr.fetchone()
+            if not row or not row[0]:
+                TOKEN_OPERATIONS.inc(operation='consume', result='user_inactive')
                 _logger.error("❌ User not found or inactive")
                 return request.render('web.login', {
                     'error': 'المستخدم غير موجود أو غير نشط'
                 })
-            
-            # ✅ حذف الـ token بعد الاستخدام
-            del TOKEN_STORAGE[token]
-            _logger.info("🗑️ Token deleted after use")
+
+            lang, tz = data['lang'], data['tz']
+            if row[1] != data['user_version']:
+                # المستخدم تغيّر منذ توليد الرابط: قراءة lang / tz من جديد
+                user = request.env['res.users'].sudo().browse(user_id)
+                lang, tz = user.lang or 'en_US', user.tz or 'UTC'
             
             # ✅✅✅ تسجيل الدخول في Odoo 18 - الطريقة المبسطة
             # تنظيف الـ session القديم
@@ -164,23 +245,22 @@ class SaasAutoLoginController(http.Controller):
             request.session.db = db_name
             request.session.session_token = secrets.token_hex(16)
             request.session.context = {
-                'lang': user.lang or 'en_US',
-                'tz': user.tz or 'UTC',
+                'lang': lang,
+                'tz': tz,
                 'uid': user_id,
             }
             
-            # تحديث الـ environment
-            request.update_env(user=user_id)
-            
             # ✅ حفظ التغييرات في الـ session يدوياً
             request.session.modified = True
             
+            TOKEN_OPERATIONS.inc(operation='consume', result='success')
             _logger.info("✅✅✅ Autologin SUCCESS for user: %s (ID: %d)", user_login, user_id)
             
             # ✅ إعادة التوجيه للصفحة الرئيسية
             return werkzeug.utils.redirect('/web', 303)
             
         except Exception as e:
+            TOKEN_OPERATIONS.inc(operation='consume', result='error')
             _logger.error("❌ Autologin FAILED: %s", str(e), exc_info=True)
             return request.render('web.login', {
                 'error': f'فشل تسجيل الدخول: {str(e)}'
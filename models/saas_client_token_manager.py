@@ -1,12 +1,29 @@
 # -*- coding: utf-8 -*-
-from odoo import api, fields, models, _
+from odoo import api, fields, http, models, tools, _
 from odoo.exceptions import UserError
+from odoo.http import request, Response
+from odoo.modules.registry import Registry
+from .saas_metrics import TOKEN_OPERATIONS, AggregatedLog
+from datetime import datetime
+import csv
+import hashlib
+import io
+import ipaddress
 import logging
 import json
+import re
 import time
 
 _logger = logging.getLogger(__name__)
 
+TOKEN_KEY_PREFIX = 'saas_auto_login_token_'
+
+# شكل الـ token المقبول (token_urlsafe) - أي شيء آخر يُرفض بدون قاعدة بيانات
+TOKEN_FORMAT = re.compile(r'[A-Za-z0-9_-]{32,256}')
+
+# سطر log واحد مجمّع للـ tokens المرفوضة بدلاً من سطر لكل محاولة
+_rejected_tokens_log = AggregatedLog(_logger, "⚠️ Rejected auto-login tokens")
+
 
 class SaasClientTokenManager(models.AbstractModel):
     """
@@ -23,16 +40,25 @@ class SaasClientTokenManager(models.AbstractModel):
         :param token: الـ token المراد التحقق منه
         :return: dict مع بيانات المستخدم أو False
         """
-        if not token or len(token) < 32:
-            _logger.warning("⚠️ Invalid token format")
+        if not token or not isinstance(token, str) or not TOKEN_FORMAT.fullmatch(token):
+            TOKEN_OPERATIONS.inc(operation='validate', result='invalid_format')
+            _rejected_tokens_log.add('invalid_format')
             return {'valid': False, 'reason': 'invalid_format'}
 
-        token_key = f'saas_auto_login_token_{token}'
+        token_key = f'{TOKEN_KEY_PREFIX}{token}'
+
+        # Pre-filter: الـ tokens غير المعروفة تُرفض من الـ cache بدون قراءة ir.config_parameter
+        if token_key not in self._live_token_keys():
+            TOKEN_OPERATIONS.inc(operation='validate', result='not_found')
+            _rejected_tokens_log.add('not_found')
+            return {'valid': False, 'reason': 'not_found'}
+
         config_param = self.env['ir.config_parameter'].sudo()
         token_data_str = config_param.get_param(token_key)
 
         if not token_data_str:
-            _logger.warning("⚠️ Token not found: %s...", token[:10])
+            TOKEN_OPERATIONS.inc(operation='validate', result='not_found')
+            _rejected_tokens_log.add('not_found')
             return {'valid': False, 'reason': 'not_found'}
 
         try:
@@ -42,12 +68,14 @@ class SaasClientTokenManager(models.AbstractModel):
             # التحقق من انتهاء الصلاحية
             current_time = int(time.time())
             if current_time > token_data['expiry']:
-                _logger.warning("⚠️ Token expired: %s...", token[:10])
+                TOKEN_OPERATIONS.inc(operation='validate', result='expired')
+                _rejected_tokens_log.add('expired')
                 # حذف الـ token المنتهي
                 config_param.set_param(token_key, False)
                 return {'valid': False, 'reason': 'expired'}
 
-            _logger.info("✅ Token validated successfully for user_id: %s", token_data['user_id'])
+            TOKEN_OPERATIONS.inc(operation='validate', result='valid')
+            _logger.debug("✅ Token validated successfully for user_id: %s", token_data['user_id'])
             
             return {
                 'valid': True,
@@ -57,9 +85,23 @@ class SaasClientTokenManager(models.AbstractModel):
             }
 
         except Exception as e:
+            TOKEN_OPERATIONS.inc(operation='validate', result='parse_error')
             _logger.error("❌ Failed to validate token: %s", str(e))
             return {'valid': False, 'reason': 'parse_error', 'error': str(e)}
 
+    @api.model
+    @tools.ormcache()
+    def _live_token_keys(self):
+        """
+        مفاتيح الـ tokens الموجودة حالياً (cache لكل worker)
+        يتم مسح الـ cache تلقائياً مع أي تعديل على ir.config_parameter في أي worker
+        """
+        self.env.cr.execute(
+            "SELECT key FROM ir_config_parameter WHERE key LIKE %s",
+            [TOKEN_KEY_PREFIX.replace('_', '\\_') + '%'],
+        )
+        return frozenset(key for key, in self.env.cr.fetchall())
+
     @api.model
     def _parse_token_data(self, token_data_str):
         """
@@ -120,7 +162,7 @@ class SaasClientTokenManager(models.AbstractModel):
             
             # البحث عن جميع tokens
             all_tokens = config_param.search([
-                ('key', 'like', 'saas_auto_login_token_%')
+                ('key', 'like', TOKEN_KEY_PREFIX + '%')
             ])
             
             current_time = int(time.time())
@@ -170,7 +212,7 @@ class SaasClientTokenManager(models.AbstractModel):
         try:
             config_param = self.env['ir.config_parameter'].sudo()
             all_tokens = config_param.search([
-                ('key', 'like', 'saas_auto_login_token_%')
+                ('key', 'like', TOKEN_KEY_PREFIX + '%')
             ])
             
             current_time = int(time.time())
@@ -197,59 +239,119 @@ class SaasClientTokenManager(models.AbstractModel):
             _logger.error("❌ Failed to get token stats: %s", str(e))
             return {'total': 0, 'active': 0, 'expired': 0, 'error': str(e)}
 
+    @api.model
+    def _consume_token(self, token_key):
+        """
+        حذف الـ token وإرجاع بياناته + حالة المستخدم في round trip واحد (atomic)
+        عند التنفيذ المتزامن لنفس الـ token، عملية واحدة فقط تحصل على الصف
+
+        :param token_key: مفتاح الـ token في ir.config_parameter
+        :return: tuple (value, user_id, active, login, name) أو None إذا لم يوجد
+        """
+        self.env.cr.execute(r"""
+            WITH consumed AS (
+                DELETE FROM ir_config_parameter
+                 WHERE key = %s
+             RETURNING value
+            )
+            SELECT c.value, u.id, u.active, u.login, p.name
+              FROM consumed c
+              LEFT JOIN res_users u ON u.id = COALESCE(
+                    substring(c.value from '"user_id"\s*:\s*(\d{1,9})'),
+                    substring(c.value from '^(\d{1,9})\|')
+                )::int
+              LEFT JOIN res_partner p ON p.id = u.partner_id
+        """, [token_key])
+        row = self.env.cr.fetchone()
+
+        if row:
+            # الحذف تم بـ SQL مباشرة: مسح cache الـ parameters مرة واحدة
+            self.env['ir.config_parameter'].invalidate_model()
+            self.env.registry.clear_cache()
+        return row
+
     @api.model
     def validate_and_login_user(self, token):
         """
         التحقق من الـ Token وتسجيل دخول المستخدم
         دالة مركزية تجمع كل العمليات
+        الـ token يُستهلك بعملية fetch-and-delete واحدة (single-use حتى مع التزامن)
         
         :param token: الـ token
         :return: dict مع النتيجة
         """
-        # التحقق من الـ token
-        validation_result = self.validate_token(token)
-        
-        if not validation_result['valid']:
-            return {
-                'success': False,
-                'reason': validation_result['reason'],
-                'error': validation_result.get('error')
-            }
-        
-        user_id = validation_result['user_id']
-        token_key = validation_result['token_key']
-        
-        # جلب بيانات المستخدم
-        user = self.env['res.users'].sudo().browse(user_id)
-        
-        if not user.exists():
-            _logger.error("❌ User not found: %s", user_id)
-            self.delete_token(token_key)
-            return {
-                'success': False,
-                'reason': 'user_not_found',
-                'user_id': user_id
-            }
-        
-        if not user.active:
-            _logger.error("❌ User is inactive: %s", user.login)
-            return {
-                'success': False,
-                'reason': 'user_inactive',
-                'user_name': user.name
-            }
-        
-        # حذف الـ token (single-use)
-        self.delete_token(token_key)
+        if not token or not isinstance(token, str) or not TOKEN_FORMAT.fullmatch(token):
+            return self._consume_failed('invalid_format')
+
+        token_key = f'{TOKEN_KEY_PREFIX}{token}'
+        if token_key not in self._live_token_keys():
+            return self._consume_failed('not_found')
+
+        row = self._consume_token(token_key)
+        if not row:
+            # غير موجود أو تم استهلاكه للتو من طلب آخر
+            return self._consume_failed('not_found')
+
+        token_data_str, user_id, active, login, name = row
+
+        try:
+            token_data = self._parse_token_data(token_data_str)
+        except ValueError as e:
+            return self._consume_failed('parse_error', error=str(e))
+
+        if int(time.time()) > token_data['expiry']:
+            return self._consume_failed('expired')
+
+        if not user_id:
+            _logger.error("❌ User not found: %s", token_data['user_id'])
+            return self._consume_failed('user_not_found', user_id=token_data['user_id'])
+
+        if not active:
+            _logger.error("❌ User is inactive: %s", login)
+            return self._consume_failed('user_inactive', user_name=name)
+
+        TOKEN_OPERATIONS.inc(operation='consume', result='success')
         
         return {
             'success': True,
-            'user': user,
-            'user_id': user.id,
-            'user_name': user.name,
-            'user_login': user.login
+            'user': self.env['res.users'].sudo().browse(user_id),
+            'user_id': user_id,
+            'user_name': name,
+            'user_login': login
         }
 
+    @api.model
+    def _consume_failed(self, reason, **values):
+        """نتيجة فشل استهلاك الـ token (مع تسجيلها في المقاييس)"""
+        TOKEN_OPERATIONS.inc(operation='consume', result=reason)
+        if reason in ('invalid_format', 'not_found', 'expired'):
+            _rejected_tokens_log.add(reason)
+        return dict(values, success=False, reason=reason, error=values.get('error'))
+
+
+class Inet(fields.Char):
+    """عنوان IP مخزن في عمود inet (مضغوط + يدعم البحث بالنطاق عبر btree)"""
+    column_type = ('inet', 'inet')
+
+
+# أعمدة التجميع المسموح بها في aggregate_attempts
+AGGREGATE_KEYS = {
+    'ip': 'host(ip_address)',
+    'user': 'user_id',
+    'type': 'login_type',
+    'hour': "date_trunc('hour', create_date)",
+    'day': "date_trunc('day', create_date)",
+}
+
+
+# أعمدة التصدير (بنفس ترتيب _fetch_export_batch)
+EXPORT_COLUMNS = ('create_date', 'id', 'user_id', 'login_type', 'ip_address', 'success',
+                  'token_hash', 'error_message', 'metadata')
+EXPORT_BATCH_SIZE = 2000
+# create_date = وقت بدء المعاملة وليس وقت الـ commit: التصدير لا يتجاوز (الآن - هذه المدة)
+# حتى لا يفوت cursor لاحق صفوفاً من معاملات طويلة (أطول منها غير مضمونة)
+EXPORT_SAFETY_LAG_SECONDS = 300
+
 
 class SaasClientSecurityLog(models.Model):
     """
@@ -257,7 +359,7 @@ class SaasClientSecurityLog(models.Model):
     """
     _name = 'saas.client.security.log'
     _description = 'SaaS Client Security Log'
-    _order = 'create_date desc'
+    _order = 'create_date desc, id desc'
     _rec_name = 'user_id'
 
     user_id = fields.Many2one(
@@ -274,20 +376,43 @@ class SaasClientSecurityLog(models.Model):
         ('user_inactive', 'User Inactive'),
     ], string='Type', required=True)
 
-    ip_address = fields.Char(string='IP Address')
+    ip_address = Inet(string='IP Address')
     
     user_agent = fields.Text(string='User Agent')
     
     token_hash = fields.Char(
         string='Token Hash',
-        help='First 10 characters of token for tracking'
+        size=64,
+        help='SHA-256 of the token (hex) for tracking'
     )
     
     success = fields.Boolean(string='Success', default=False)
     
     error_message = fields.Text(string='Error Message')
     
-    metadata = fields.Text(string='Metadata (JSON)')
+    metadata = fields.Json(string='Metadata')
+
+    def init(self):
+        """Indexes للتحقيق الجنائي: حسب IP / المستخدم / الفترة الزمنية"""
+        tools.create_index(self.env.cr, 'saas_client_security_log_ip_date_idx',
+                           self._table, ['ip_address', 'create_date'])
+        tools.create_index(self.env.cr, 'saas_client_security_log_user_date_idx',
+                           self._table, ['user_id', 'create_date'])
+        # (create_date, id): نطاقات زمنية + keyset pagination للتصدير
+        tools.create_index(self.env.cr, 'saas_client_security_log_date_id_idx',
+                           self._table, ['create_date', 'id'])
+
+    @api.model
+    def _hash_token(self, token):
+        return hashlib.sha256(token.encode()).hexdigest() if token else False
+
+    @api.model
+    def _normalize_ip(self, ip_address):
+        """عنوان صالح أو False (قيمة غير صالحة تفشل في عمود inet)"""
+        try:
+            return str(ipaddress.ip_address(ip_address)) if ip_address else False
+        except ValueError:
+            return False
 
     @api.model
     def log_attempt(self, user_id, login_type, success=False, **kwargs):
@@ -304,11 +429,11 @@ class SaasClientSecurityLog(models.Model):
                 'user_id': user_id if isinstance(user_id, int) else False,
                 'login_type': login_type,
                 'success': success,
-                'ip_address': kwargs.get('ip_address'),
+                'ip_address': self._normalize_ip(kwargs.get('ip_address')),
                 'user_agent': kwargs.get('user_agent'),
-                'token_hash': kwargs.get('token_hash'),
+                'token_hash': kwargs.get('token_hash') or self._hash_token(kwargs.get('token')),
                 'error_message': kwargs.get('error_message'),
-                'metadata': json.dumps(kwargs.get('metadata', {}))
+                'metadata': kwargs.get('metadata') or {}
             }
             
             self.sudo().create(values)
@@ -341,3 +466,202 @@ class SaasClientSecurityLog(models.Model):
         except Exception as e:
             _logger.error("❌ Failed to cleanup old logs: %s", str(e))
             return 0
+
+    @api.model
+    def _where_clause(self, ip_range=None, user_id=None, date_from=None, date_to=None,
+                      success=None, login_types=None):
+        """بناء شروط WHERE التي تستخدم الـ indexes (ip / user / create_date)"""
+        clauses, params = [], []
+        if ip_range:
+            # '10.0.0.0/8' أو عنوان واحد - <<= يستخدم btree index على inet
+            clauses.append("ip_address <<= %s::inet")
+            params.append(ip_range)
+        if user_id:
+            clauses.append("user_id = %s")
+            params.append(user_id)
+        if date_from:
+            clauses.append("create_date >= %s")
+            params.append(date_from)
+        if date_to:
+            clauses.append("create_date < %s")
+            params.append(date_to)
+        if success is not None:
+            clauses.append("success = %s")
+            params.append(bool(success))
+        if login_types:
+            clauses.append("login_type IN %s")
+            params.append(tuple(login_types))
+        return ' AND '.join(clauses) or 'TRUE', params
+
+    @api.model
+    def search_attempts(self, ip_range=None, user_id=None, date_from=None, date_to=None,
+                        success=None, login_types=None, limit=1000):
+        """
+        البحث في السجلات بدون تحميل ORM records (للتحقيق في الحوادث)
+
+        :param ip_range: عنوان أو نطاق CIDR مثل '10.0.0.0/8'
+        :return: list of dicts مرتبة من الأحدث
+        """
+        self.check_access('read')
+        where, params = self._where_clause(ip_range, user_id, date_from, date_to, success, login_types)
+        self.env.cr.execute(f"""
+            SELECT id, create_date, user_id, login_type, host(ip_address), success, token_hash, error_message
+              FROM saas_client_security_log
+             WHERE {where}
+             ORDER BY create_date DESC, id DESC
+             LIMIT %s
+        """, params + [limit])
+        columns = ('id', 'create_date', 'user_id', 'login_type', 'ip_address', 'success',
+                   'token_hash', 'error_message')
+        return [dict(zip(columns, row)) for row in self.env.cr.fetchall()]
+
+    @api.model
+    def aggregate_attempts(self, group_by='ip', ip_range=None, user_id=None, date_from=None,
+                           date_to=None, success=None, login_types=None, limit=100):
+        """
+        تجميع المحاولات (مثال: أكثر عناوين IP فشلاً في آخر ساعة)
+
+        :param group_by: 'ip' / 'user' / 'type' / 'hour' / 'day'
+        :return: list of dicts {'key', 'attempts', 'failures', 'first', 'last'}
+        """
+        self.check_access('read')
+        if group_by not in AGGREGATE_KEYS:
+            raise UserError(_("Unsupported grouping: %s") % group_by)
+
+        key = AGGREGATE_KEYS[group_by]
+        where, params = self._where_clause(ip_range, user_id, date_from, date_to, success, login_types)
+        self.env.cr.execute(f"""
+            SELECT {key}, COUNT(*), COUNT(*) FILTER (WHERE NOT success),
+                   MIN(create_date), MAX(create_date)
+              FROM saas_client_security_log
+             WHERE {where}
+             GROUP BY 1
+             ORDER BY 2 DESC
+             LIMIT %s
+        """, params + [limit])
+        return [{
+            'key': key_value,
+            'attempts': attempts,
+            'failures': failures,
+            'first': first,
+            'last': last,
+        } for key_value, attempts, failures, first, last in self.env.cr.fetchall()]
+
+    # ==================== Streaming Export (SIEM) ====================
+
+    @api.model
+    def _format_export_cursor(self, create_date, record_id):
+        return '%s,%s' % (create_date.isoformat(), record_id)
+
+    @api.model
+    def _parse_export_cursor(self, cursor):
+        """'<create_date ISO>,<id>' => (datetime, id)"""
+        try:
+            create_date, record_id = cursor.rsplit(',', 1)
+            return datetime.fromisoformat(create_date), int(record_id)
+        except (AttributeError, ValueError):
+            raise UserError(_("Invalid export cursor: %s") % cursor)
+
+    @api.model
+    def _export_upper_bound(self):
+        """
+        آخر سجل أقدم من EXPORT_SAFETY_LAG_SECONDS لحظة بدء التصدير - التصدير يتوقف عنده
+        السجلات الأحدث تُصدّر في السحب التالي (بعد أن تكون معاملاتها قد انتهت)
+        """
+        self.env.cr.execute("""
+            SELECT create_date, id FROM saas_client_security_log
+             WHERE create_date <= (now() AT TIME ZONE 'UTC') - make_interval(secs => %s)
+             ORDER BY create_date DESC, id DESC
+             LIMIT 1
+        """, [EXPORT_SAFETY_LAG_SECONDS])
+        return self.env.cr.fetchone()
+
+    @api.model
+    def _fetch_export_batch(self, after, until, batch_size=EXPORT_BATCH_SIZE):
+        """
+        دفعة واحدة بـ keyset pagination على (create_date, id): تبدأ بعد after وتنتهي عند until
+        التكلفة O(الصفوف الجديدة) والذاكرة ثابتة (دفعة واحدة في كل مرة)
+        """
+        where = "(create_date, id) <= (%s, %s)"
+        params = list(until)
+        if after:
+            where += " AND (create_date, id) > (%s, %s)"
+            params += list(after)
+        self.env.cr.execute(f"""
+            SELECT create_date, id, user_id, login_type, host(ip_address), success,
+                   token_hash, error_message, metadata
+              FROM saas_client_security_log
+             WHERE {where}
+             ORDER BY create_date, id
+             LIMIT %s
+        """, params + [batch_size])
+        return self.env.cr.fetchall()
+
+
+class SaasSecurityLogExportController(http.Controller):
+
+    @http.route('/saas/security_log/export', type='http', auth='user', methods=['GET'], csrf=False)
+    def export_security_log(self, format='ndjson', since=None, **kwargs):
+        """
+        تصدير سجلات الأمان بشكل stream (NDJSON أو CSV)
+
+        :param format: 'ndjson' أو 'csv'
+        :param since: cursor من تصدير سابق - يتم تصدير السجلات الأحدث منه فقط
+        الـ header X-Next-Cursor يحتوي على cursor التصدير التالي
+        آخر EXPORT_SAFETY_LAG_SECONDS (5 دقائق) لا تُصدّر بعد: تظهر في السحب التالي
+        """
+        if not request.env.user.has_group('base.group_system'):
+            return request.make_response('Forbidden', status=403)
+        if format not in ('ndjson', 'csv'):
+            return request.make_response('Unsupported format', status=400)
+
+        Log = request.env['saas.client.security.log']
+        after = Log._parse_export_cursor(since) if since else None
+        until = Log._export_upper_bound()
+        if after and until and tuple(until) <= after:
+            # لا شيء جديد خارج فترة الأمان: الـ cursor لا يرجع للخلف
+            until = None
+
+        headers = [('X-Next-Cursor', Log._format_export_cursor(*until) if until else (since or ''))]
+        if format == 'csv':
+            mimetype = 'text/csv'
+            headers.append(('Content-Disposition', 'attachment; filename=saas_security_log.csv'))
+        else:
+            mimetype = 'application/x-ndjson'
+
+        body = self._stream_rows(request.env.cr.dbname, request.env.uid, after, until, format) if until else iter(())
+        return Response(body, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+    def _stream_rows(self, dbname, uid, after, until, format):
+        """
+        Generator يعمل بعد انتهاء الـ request (أثناء إرسال الـ response)
+        cursor قصير لكل دفعة يُغلق قبل إرسالها: لا snapshot ولا اتصال محجوز
+        طوال التحميل (الـ keyset + until يضمنان نتيجة متسقة بين الدفعات)
+        """
+        columns = EXPORT_COLUMNS
+        if format == 'csv':
+            yield (','.join(columns + ('cursor',)) + '\r\n').encode()
+
+        while True:
+            with Registry(dbname).cursor() as cr:
+                Log = api.Environment(cr, uid, {})['saas.client.security.log']
+                rows = Log._fetch_export_batch(after, until)
+            if not rows:
+                return
+
+            buffer = io.StringIO()
+            writer = csv.writer(buffer) if format == 'csv' else None
+            for row in rows:
+                values = dict(zip(columns, row))
+                values['create_date'] = row[0].isoformat()
+                values['cursor'] = Log._format_export_cursor(row[0], row[1])
+                if writer:
+                    values['metadata'] = json.dumps(values['metadata']) if values['metadata'] else ''
+                    writer.writerow([values[column] for column in columns + ('cursor',)])
+                else:
+                    buffer.write(json.dumps(values) + '\n')
+            yield buffer.getvalue().encode()
+
+            if len(rows) < EXPORT_BATCH_SIZE:
+                return
+            after = rows[-1][:2]
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+مقاييس داخلية (Counters / Histograms / Gauges) بصيغة Prometheus
+
+- التسجيل يتم في الذاكرة فقط (بدون log وبدون قاعدة بيانات)
+- كل worker يكتب snapshot دوري في data_dir/saas_metrics/<host>-<pid>-<start>.json
+- الـ endpoint /saas/metrics يجمع كل الـ snapshots (prefork workers)
+"""
+from odoo import http
+from odoo.http import request
+from odoo.tools import config
+import bisect
+import fcntl
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# أقل فترة بين كتابتين للـ snapshot من نفس الـ worker
+FLUSH_INTERVAL = 5.0
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+_REGISTRY = {}
+_LOCK = threading.Lock()
+_FLUSH_STATE = {'last': 0.0}
+
+DEAD_WORKERS_FILE = 'dead.json'
+LOCK_FILE = 'lock'
+
+# data_dir قد يكون مشتركاً بين عدة أجهزة: اسم الـ snapshot = <host>-<pid>-<start time>
+HOSTNAME = socket.gethostname()
+_SNAPSHOT_NAMES = {}
+
+
+class _Metric:
+    """أساس كل المقاييس: قيم مفهرسة بـ tuple من قيم الـ labels"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def _snapshot(self):
+        return {
+            'kind': self.kind,
+            'doc': self.documentation,
+            'labelnames': list(self.labelnames),
+            'values': [[list(key), value] for key, value in self._values.items()],
+        }
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _LOCK:
+            self._values[key] = self._values.get(key, 0) + amount
+        _maybe_flush()
+
+
+class Gauge(_Metric):
+    """قيمة لحظية لكل worker - يتم جمعها عبر الـ workers الأحياء فقط"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _LOCK:
+            self._values[key] = value
+        _maybe_flush()
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    """
+    الحالة لكل مجموعة labels: [عدد كل bucket (غير تراكمي) ..., عدد +Inf, المجموع]
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with _LOCK:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+        _maybe_flush()
+
+    def time(self, **labels):
+        """قياس زمن تنفيذ block: with HISTOGRAM.time(operation='create'): ..."""
+        return _Timer(self, labels)
+
+    def _snapshot(self):
+        snapshot = super()._snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+
+# ==================== Module Metrics ====================
+
+USER_LIMIT_CHECKS = Counter(
+    'saas_user_limit_checks_total',
+    'User limit checks by operation and result (allowed / rejected)',
+    ('operation', 'result'),
+)
+
+USER_LIMIT_CHECK_SECONDS = Histogram(
+    'saas_user_limit_check_seconds',
+    'Latency of user limit checks',
+    ('operation',),
+)
+
+STORAGE_QUOTA_CHECKS = Counter(
+    'saas_storage_quota_checks_total',
+    'Storage quota checks by model and result (allowed / blocked)',
+    ('model', 'result'),
+)
+
+STORAGE_QUOTA_CHECK_SECONDS = Histogram(
+    'saas_storage_quota_check_seconds',
+    'Latency of storage quota checks',
+)
+
+TOKEN_OPERATIONS = Counter(
+    'saas_token_operations_total',
+    'Auto-login token operations (mint / validate / consume) by result',
+    ('operation', 'result'),
+)
+
+
+LOG_PENDING_EVENTS = Gauge(
+    'saas_log_pending_events',
+    'Repeated events buffered by aggregated loggers, waiting for the next summary line',
+    ('logger',),
+)
+
+
+class AggregatedLog:
+    """
+    تجميع الأحداث المتكررة (مثل tokens غير صالحة) في سطر log واحد كل interval
+    بدلاً من سطر لكل محاولة
+    """
+
+    def __init__(self, logger, message, interval=60.0):
+        self.logger = logger
+        self.message = message
+        self.interval = interval
+        self._counts = {}
+        self._pending = 0
+        self._since = time.monotonic()
+
+    def add(self, reason):
+        with _LOCK:
+            self._counts[reason] = self._counts.get(reason, 0) + 1
+            self._pending += 1
+            pending = self._pending
+        LOG_PENDING_EVENTS.set(pending, logger=self.logger.name)
+
+        now = time.monotonic()
+        if now - self._since >= self.interval:
+            self.emit(now)
+
+    def emit(self, now=None):
+        now = now or time.monotonic()
+        with _LOCK:
+            counts, self._counts = self._counts, {}
+            self._pending = 0
+            elapsed, self._since = now - self._since, now
+        LOG_PENDING_EVENTS.set(0, logger=self.logger.name)
+
+        if counts:
+            self.logger.warning(
+                "%s in the last %ds: %s",
+                self.message,
+                elapsed,
+                ', '.join('%s=%s' % item for item in sorted(counts.items())),
+            )
+
+
+# ==================== Snapshots (prefork aggregation) ====================
+
+def _metrics_dir():
+    data_dir = config.get('data_dir')
+    if not data_dir:
+        return None
+    return os.path.join(data_dir, 'saas_metrics')
+
+
+def _maybe_flush():
+    now = time.monotonic()
+    if now - _FLUSH_STATE['last'] >= FLUSH_INTERVAL:
+        _FLUSH_STATE['last'] = now
+        flush()
+
+
+def _process_start(pid):
+    """وقت بدء العملية من /proc (Linux) - يميز إعادة استخدام نفس الـ PID"""
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # الحقل 22 (starttime) بعد "pid (comm)"
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return '0'
+
+
+def _snapshot_name():
+    pid = os.getpid()
+    name = _SNAPSHOT_NAMES.get(pid)
+    if name is None:
+        name = _SNAPSHOT_NAMES[pid] = '%s-%d-%s' % (HOSTNAME, pid, _process_start(pid))
+    return name
+
+
+def flush():
+    """كتابة snapshot الـ worker الحالي (atomic replace)"""
+    directory = _metrics_dir()
+    if not directory:
+        return
+    with _LOCK:
+        snapshot = {name: metric._snapshot() for name, metric in _REGISTRY.items()}
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '%s.json' % _snapshot_name())
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        _logger.warning("Failed to write metrics snapshot: %s", str(e))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _snapshot_dead(host, pid, start):
+    """
+    هل انتهى الـ worker صاحب الـ snapshot؟
+    الأجهزة الأخرى لا يمكن فحصها من هنا: تعتبر حية دائماً
+    """
+    if host != HOSTNAME:
+        return False
+    if not _pid_alive(pid):
+        return True
+    # نفس الـ PID لكن لعملية أخرى (إعادة استخدام)
+    return start != '0' and _process_start(pid) != start
+
+
+def _merge(target, snapshot, include_gauges=True):
+    for name, metric in snapshot.items():
+        if metric['kind'] == 'gauge' and not include_gauges:
+            continue
+        merged = target.setdefault(name, {
+            'kind': metric['kind'],
+            'doc': metric['doc'],
+            'labelnames': metric['labelnames'],
+            'buckets': metric.get('buckets'),
+            'values': {},
+        })
+        values = merged['values']
+        for key, value in metric['values']:
+            key = tuple(key)
+            if key not in values:
+                values[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                values[key] = [a + b for a, b in zip(values[key], value)]
+            else:
+                values[key] += value
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _serializable(merged):
+    return {
+        name: dict(metric, values=[[list(key), value] for key, value in metric['values'].items()])
+        for name, metric in merged.items()
+    }
+
+
+def collect():
+    """
+    تجميع snapshots كل الـ workers
+    - snapshots الـ workers المنتهية تُدمج في dead.json (counters / histograms فقط)
+    - فقط workers هذا الجهاز يمكن اعتبارها منتهية
+    """
+    flush()
+    directory = _metrics_dir()
+    merged = {}
+    if not directory or not os.path.isdir(directory):
+        with _LOCK:
+            _merge(merged, {name: metric._snapshot() for name, metric in _REGISTRY.items()})
+        return merged
+
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            dead_path = os.path.join(directory, DEAD_WORKERS_FILE)
+            dead = {}
+            _merge(dead, _load(dead_path), include_gauges=False)
+            dead_changed = False
+
+            for filename in os.listdir(directory):
+                name, ext = os.path.splitext(filename)
+                parts = name.rsplit('-', 2)
+                if ext != '.json' or len(parts) != 3 or not parts[1].isdigit():
+                    continue
+                host, pid, start = parts
+                path = os.path.join(directory, filename)
+                snapshot = _load(path)
+                if not _snapshot_dead(host, int(pid), start):
+                    _merge(merged, snapshot)
+                else:
+                    _merge(dead, snapshot, include_gauges=False)
+                    os.unlink(path)
+                    dead_changed = True
+
+            if dead_changed:
+                tmp_path = dead_path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(_serializable(dead), f)
+                os.replace(tmp_path, dead_path)
+
+            _merge(merged, _serializable(dead))
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # المقاييس المعرفة بدون قيم تظهر أيضاً (HELP / TYPE)
+    with _LOCK:
+        for name, metric in _REGISTRY.items():
+            if name not in merged:
+                _merge(merged, {name: metric._snapshot()})
+    return merged
+
+
+# ==================== Prometheus Text Format ====================
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labelnames, key, extra=None):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append('%s="%s"' % extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """تحويل المقاييس المجمعة إلى Prometheus text format (0.0.4)"""
+    lines = []
+    for name, metric in sorted(collect().items()):
+        labelnames = metric['labelnames']
+        lines.append('# HELP %s %s' % (name, metric['doc']))
+        lines.append('# TYPE %s %s' % (name, metric['kind']))
+        for key, value in sorted(metric['values'].items()):
+            if metric['kind'] != 'histogram':
+                lines.append('%s%s %s' % (name, _labels(labelnames, key), _number(value)))
+                continue
+            cumulative = 0
+            bounds = list(metric['buckets']) + [float('inf')]
+            for bound, count in zip(bounds, value[:-1]):
+                cumulative += count
+                lines.append('%s_bucket%s %s' % (
+                    name, _labels(labelnames, key, ('le', _number(bound))), cumulative))
+            lines.append('%s_sum%s %s' % (name, _labels(labelnames, key), _number(value[-1])))
+            lines.append('%s_count%s %s' % (name, _labels(labelnames, key), cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+class SaasMetricsController(http.Controller):
+
+    @http.route('/saas/metrics', type='http', auth='none', methods=['GET'], csrf=False, save_session=False)
+    def metrics(self, **kwargs):
+        """
+        Prometheus scrape endpoint - محمي بـ saas_metrics_token من ملف الإعدادات
+        بدون token في الإعدادات: الـ endpoint غير متاح (404)
+        """
+        expected = config.get('saas_metrics_token')
+        if not expected:
+            return request.make_response('Not Found', status=404)
+        provided = request.httprequest.headers.get('Authorization', '')
+        if not hmac.compare_digest(provided, 'Bearer %s' % expected):
+            return request.make_response('Unauthorized', status=401)
+
+        return request.make_response(render(), headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+        ])
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Token bucket rate limiter مشترك بين الـ prefork workers
+
+- الحالة في ملف mmap صغير داخل data_dir/saas_ratelimit/<name>.bin
+- كل slot: (hash المفتاح، عدد الـ tokens المتبقية، آخر تحديث)
+- الملف مشترك بين كل قواعد البيانات: المفاتيح يجب أن تشمل اسم القاعدة
+- القفل بـ flock على الملف (بين العمليات) + threading.Lock (بين الـ threads)
+"""
+from odoo.tools import config
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .saas_metrics import Counter
+
+_logger = logging.getLogger(__name__)
+
+SLOT = struct.Struct('<Qdd')
+SLOTS = 8192
+PROBES = 4
+
+RATE_LIMIT_REJECTIONS = Counter(
+    'saas_rate_limit_rejections_total',
+    'Requests rejected with 429 by limiter',
+    ('limiter',),
+)
+
+
+class RateLimiter:
+    """
+    rate: عدد الطلبات المسموح بها في الثانية (معدل إعادة التعبئة)
+    burst: أقصى عدد طلبات متتالية
+    """
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._map = None
+        self._disabled = False
+
+    def _open(self):
+        # الملف يُفتح بعد الـ fork في كل worker: flock مرتبط بالـ file description
+        if self._pid == os.getpid():
+            return self._map
+        data_dir = config.get('data_dir')
+        if not data_dir:
+            self._disabled = True
+            return None
+        try:
+            directory = os.path.join(data_dir, 'saas_ratelimit')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, '%s.bin' % self.name)
+            self._file = open(path, 'a+b')
+            size = SLOTS * SLOT.size
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            self._pid = os.getpid()
+        except OSError as e:
+            _logger.warning("Rate limiter %s disabled: %s", self.name, str(e))
+            self._disabled = True
+            return None
+        return self._map
+
+    def hit(self, key):
+        """
+        استهلاك token واحد للمفتاح
+
+        :return: (allowed, retry_after_seconds)
+        """
+        if self._disabled:
+            return True, 0
+        key_hash = int.from_bytes(
+            hashlib.blake2b(str(key).encode(), digest_size=8).digest(), 'little'
+        ) | 1
+        now = time.time()
+
+        with self._lock:
+            mm = self._open()
+            if mm is None:
+                return True, 0
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                position, tokens, updated = self._find_slot(mm, key_hash, now)
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                SLOT.pack_into(mm, position, key_hash, tokens, now)
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+        if allowed:
+            return True, 0
+        RATE_LIMIT_REJECTIONS.inc(limiter=self.name)
+        return False, (1 - tokens) / self.rate
+
+    def _find_slot(self, mm, key_hash, now):
+        """
+        البحث عن slot المفتاح ضمن PROBES متتالية
+        إذا لم يوجد: slot فارغ، أو الأقدم (يبدأ بـ bucket ممتلئ)
+        """
+        start = key_hash % SLOTS
+        oldest = None
+        for probe in range(PROBES):
+            position = ((start + probe) % SLOTS) * SLOT.size
+            slot_hash, tokens, updated = SLOT.unpack_from(mm, position)
+            if slot_hash == key_hash:
+                return position, tokens, updated
+            if not slot_hash:
+                return position, self.burst, now
+            if oldest is None or updated < oldest[1]:
+                oldest = (position, updated)
+        return oldest[0], self.burst, now
+
+
+# حدود مسارات الـ autologin (قابلة للتعديل من ملف الإعدادات: طلب / دقيقة)
+GENERATE_BY_IP = RateLimiter(
+    'generate_ip', int(config.get('saas_generate_rate_per_minute', 30)) / 60.0, 10,
+)
+GENERATE_BY_USER = RateLimiter(
+    'generate_user', int(config.get('saas_generate_user_rate_per_minute', 5)) / 60.0, 5,
+)
+AUTOLOGIN_BY_IP = RateLimiter(
+    'autologin_ip', int(config.get('saas_autologin_rate_per_minute', 30)) / 60.0, 10,
+)
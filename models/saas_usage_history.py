@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+USAGE_METRICS = [
+    ('users', 'Internal Users'),
+    ('storage', 'Storage (bytes)'),
+]
+
+# مدة الاحتفاظ بالعينات الخام (الملخص اليومي يبقى دائماً)
+SAMPLE_RETENTION_DAYS = 90
+
+
+class SaasUsageSample(models.Model):
+    """
+    سجل مضغوط لتغيرات الاستهلاك (delta فقط لكل تغيير)
+    القيمة المطلقة موجودة في الملخص اليومي saas.usage.daily
+    """
+    _name = 'saas.usage.sample'
+    _description = 'SaaS Usage Sample'
+    _order = 'date desc, id desc'
+    _log_access = False
+
+    date = fields.Datetime(string='Date', required=True, readonly=True)
+    metric = fields.Selection(USAGE_METRICS, string='Metric', required=True, readonly=True)
+    delta = fields.Float(string='Delta', readonly=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS saas_usage_sample_metric_date_idx
+                ON saas_usage_sample (metric, date)
+        """)
+
+
+class SaasUsageDaily(models.Model):
+    """
+    ملخص يومي للاستهلاك (open / close / peak / low) لكل مقياس
+    يستخدم للفوترة: الذروة والمتوسط لأي فترة من index مباشرة
+    """
+    _name = 'saas.usage.daily'
+    _description = 'SaaS Daily Usage'
+    _order = 'day desc, metric'
+    _log_access = False
+
+    day = fields.Date(string='Day', required=True, readonly=True)
+    metric = fields.Selection(USAGE_METRICS, string='Metric', required=True, readonly=True)
+    open_value = fields.Float(string='Opening', readonly=True)
+    close_value = fields.Float(string='Closing', readonly=True)
+    peak_value = fields.Float(string='Peak', readonly=True)
+    low_value = fields.Float(string='Low', readonly=True)
+    sample_count = fields.Integer(string='Changes', readonly=True)
+
+    _sql_constraints = [
+        ('metric_day_uniq', 'unique(metric, day)', 'Only one usage row per metric and day is allowed!'),
+    ]
+
+    @api.model
+    def _last_value(self, metric):
+        """آخر قيمة معروفة للمقياس (من index metric/day)"""
+        self.env.cr.execute("""
+            SELECT close_value FROM saas_usage_daily
+             WHERE metric = %s
+             ORDER BY day DESC
+             LIMIT 1
+        """, [metric])
+        row = self.env.cr.fetchone()
+        return row[0] if row else None
+
+    @api.model
+    def _record_usage(self, metric, value):
+        """
+        تسجيل قيمة جديدة للمقياس
+        - لا شيء يُكتب إذا لم تتغير القيمة
+        - عينة delta + تحديث الملخص اليومي (upsert) في نفس المعاملة
+        """
+        previous = self._last_value(metric)
+        if previous is not None and previous == value:
+            return False
+        if previous is None:
+            previous = value
+
+        now = fields.Datetime.now()
+        cr = self.env.cr
+        cr.execute("""
+            INSERT INTO saas_usage_sample (date, metric, delta)
+            VALUES (%s, %s, %s)
+        """, [now, metric, value - previous])
+        cr.execute("""
+            INSERT INTO saas_usage_daily AS d
+                   (day, metric, open_value, close_value, peak_value, low_value, sample_count)
+            VALUES (%(day)s, %(metric)s, %(previous)s, %(value)s,
+                    GREATEST(%(previous)s, %(value)s), LEAST(%(previous)s, %(value)s), 1)
+            ON CONFLICT (metric, day) DO UPDATE SET
+                close_value = EXCLUDED.close_value,
+                peak_value = GREATEST(d.peak_value, EXCLUDED.close_value),
+                low_value = LEAST(d.low_value, EXCLUDED.close_value),
+                sample_count = d.sample_count + 1
+        """, {'day': now.date(), 'metric': metric, 'previous': previous, 'value': value})
+        self.invalidate_model()
+        return True
+
+    @api.model
+    def _measure_storage_usage(self):
+        """
+        حجم قاعدة البيانات + حجم ملفات الـ filestore
+        (الملفات المضغوطة في الـ cold tier بحجمها المضغوط، مثل حساب الـ quota)
+        """
+        self.env.cr.execute("""
+            SELECT pg_database_size(current_database())
+                 + COALESCE((SELECT SUM(COALESCE(saas_cold_size, file_size))
+                               FROM ir_attachment WHERE store_fname IS NOT NULL), 0)
+        """)
+        return self.env.cr.fetchone()[0]
+
+    @api.model
+    def _cron_rollup_usage(self):
+        """
+        Cron يومي:
+        - أخذ عينة من استهلاك التخزين
+        - ترحيل آخر قيمة لليوم الحالي للمقاييس التي لم تتغير (صف لكل يوم)
+        - حذف العينات الخام القديمة
+        """
+        self._record_usage('storage', self._measure_storage_usage())
+
+        cr = self.env.cr
+        cr.execute("""
+            INSERT INTO saas_usage_daily
+                   (day, metric, open_value, close_value, peak_value, low_value, sample_count)
+            SELECT DISTINCT ON (metric)
+                   (now() AT TIME ZONE 'UTC')::date, metric, close_value, close_value, close_value, close_value, 0
+              FROM saas_usage_daily
+             ORDER BY metric, day DESC
+            ON CONFLICT (metric, day) DO NOTHING
+        """)
+        cr.execute("""
+            DELETE FROM saas_usage_sample
+             WHERE date < (now() AT TIME ZONE 'UTC') - make_interval(days => %s)
+        """, [SAMPLE_RETENTION_DAYS])
+        _logger.info("🧹 Usage rollup completed, %s old samples removed", cr.rowcount)
+        self.invalidate_model()
+        return True
+
+    @api.model
+    def get_usage_summary(self, metric, date_from, date_to):
+        """
+        الذروة والمتوسط لفترة (للفوترة) - من الملخص اليومي فقط
+
+        :param metric: 'users' أو 'storage'
+        :param date_from: أول يوم (شامل)
+        :param date_to: آخر يوم (شامل)
+        :return: dict {'peak', 'average', 'days'}
+        """
+        self.env.cr.execute("""
+            SELECT MAX(peak_value), AVG(close_value), COUNT(*)
+              FROM saas_usage_daily
+             WHERE metric = %s AND day BETWEEN %s AND %s
+        """, [metric, date_from, date_to])
+        peak, average, days = self.env.cr.fetchone()
+        return {
+            'metric': metric,
+            'peak': peak or 0,
+            'average': float(average or 0),
+            'days': days,
+        }
+
+    @api.model
+    def get_usage_series(self, metric, date_from, date_to):
+        """القيم اليومية لفترة: [{'day', 'open', 'close', 'peak', 'low'}]"""
+        self.env.cr.execute("""
+            SELECT day, open_value, close_value, peak_value, low_value
+              FROM saas_usage_daily
+             WHERE metric = %s AND day BETWEEN %s AND %s
+             ORDER BY day
+        """, [metric, date_from, date_to])
+        return [{
+            'day': fields.Date.to_string(day),
+            'open': open_value,
+            'close': close_value,
+            'peak': peak_value,
+            'low': low_value,
+        } for day, open_value, close_value, peak_value, low_value in self.env.cr.fetchall()]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class StorageBreakdown(models.Model):
+    """
+    لقطة (snapshot) لاستهلاك التخزين لكل جدول / موديل
+    يتم حسابها في الخلفية (Cron) وتُقرأ مباشرة بدون استعلامات ثقيلة
+    """
+    _name = 'saas.storage.breakdown'
+    _description = 'SaaS Storage Breakdown'
+    _order = 'total_bytes desc'
+    _rec_name = 'table_name'
+    _log_access = False
+
+    snapshot_date = fields.Datetime(string='Snapshot Date', readonly=True)
+    table_name = fields.Char(string='Table', readonly=True)
+    model = fields.Char(string='Model', readonly=True)
+    row_estimate = fields.Float(string='Rows (estimate)', readonly=True)
+    heap_bytes = fields.Float(string='Heap (bytes)', readonly=True)
+    index_bytes = fields.Float(string='Indexes (bytes)', readonly=True)
+    toast_bytes = fields.Float(string='TOAST (bytes)', readonly=True)
+    attachment_count = fields.Integer(string='Attachments', readonly=True)
+    attachment_bytes = fields.Float(string='Attachments (bytes)', readonly=True)
+    total_bytes = fields.Float(string='Total (bytes)', readonly=True)
+
+    @api.model
+    def _compute_table_sizes(self):
+        """أحجام الجداول من pg_class (reltuples تقديري - بدون count)"""
+        self.env.cr.execute("""
+            SELECT c.relname,
+                   GREATEST(c.reltuples, 0),
+                   pg_relation_size(c.oid),
+                   pg_indexes_size(c.oid),
+                   COALESCE(pg_total_relation_size(NULLIF(c.reltoastrelid, 0)), 0)
+              FROM pg_class c
+              JOIN pg_namespace n ON n.oid = c.relnamespace
+             WHERE c.relkind = 'r'
+               AND n.nspname = current_schema()
+        """)
+        return {
+            table: {
+                'row_estimate': rows,
+                'heap_bytes': heap,
+                'index_bytes': index,
+                'toast_bytes': toast,
+            }
+            for table, rows, heap, index, toast in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _compute_attachment_sizes(self):
+        """عدد وحجم المرفقات لكل موديل - GROUP BY واحد"""
+        self.env.cr.execute("""
+            SELECT res_model, COUNT(*), COALESCE(SUM(file_size), 0)
+              FROM ir_attachment
+             GROUP BY res_model
+        """)
+        return {model: (count, size) for model, count, size in self.env.cr.fetchall()}
+
+    @api.model
+    def _cron_compute_breakdown(self):
+        """
+        Cron: حساب اللقطة واستبدال القديمة في نفس المعاملة
+        (القراءة تبقى متاحة طوال الوقت)
+        """
+        now = fields.Datetime.now()
+        tables = self._compute_table_sizes()
+        attachments = self._compute_attachment_sizes()
+        model_by_table = {
+            model._table: name
+            for name, model in self.env.registry.items()
+            if model._auto and not model._abstract
+        }
+
+        vals_list = []
+        for table, sizes in tables.items():
+            model = model_by_table.get(table)
+            count, size = attachments.pop(model, (0, 0)) if model else (0, 0)
+            vals_list.append(dict(
+                sizes,
+                snapshot_date=now,
+                table_name=table,
+                model=model,
+                attachment_count=count,
+                attachment_bytes=size,
+            ))
+
+        # مرفقات بدون موديل أو لموديلات غير مثبتة
+        for model, (count, size) in attachments.items():
+            vals_list.append({
+                'snapshot_date': now,
+                'model': model,
+                'attachment_count': count,
+                'attachment_bytes': size,
+            })
+
+        for vals in vals_list:
+            vals['total_bytes'] = sum(vals.get(key, 0) for key in (
+                'heap_bytes', 'index_bytes', 'toast_bytes', 'attachment_bytes'
+            ))
+
+        self.search([]).unlink()
+        self.create(vals_list)
+        _logger.info("📊 Storage breakdown computed: %s tables", len(tables))
+        return True
+
+    @api.model
+    def get_storage_breakdown(self, limit=50):
+        """
+        أكبر الجداول / الموديلات استهلاكاً من آخر لقطة (للشاشة ونظام SaaS الرئيسي)
+
+        :param limit: عدد الصفوف
+        :return: dict {'snapshot_date', 'rows': [...]}
+        """
+        rows = self.search_read([], [
+            'table_name', 'model', 'row_estimate', 'heap_bytes', 'index_bytes',
+            'toast_bytes', 'attachment_count', 'attachment_bytes', 'total_bytes', 'snapshot_date',
+        ], limit=limit)
+        return {
+            'snapshot_date': rows[0]['snapshot_date'] if rows else False,
+            'rows': rows,
+        }
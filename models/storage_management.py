@@ -1,12 +1,52 @@
 # models/storage_quota_enforcer.py
 # حل بدون XML - يمنع العميل مباشرة
 
-from odoo import models, api, _
+from odoo import models, fields, api, _
 from odoo.exceptions import AccessError, UserError
+from odoo.http import Stream
+from psycopg2 import errors
+from .saas_metrics import STORAGE_QUOTA_CHECKS, STORAGE_QUOTA_CHECK_SECONDS
+from datetime import timedelta
+import gzip
 import logging
+import os
+import re
+import shutil
+import tempfile
+import time
 
 _logger = logging.getLogger(__name__)
 
+# Context key for a scoped bypass of all quota hooks
+# (module install/upgrade, data loading, designated system jobs)
+STORAGE_BYPASS_KEY = 'saas_storage_bypass'
+
+# System / framework bookkeeping models never blocked by the quota
+# (logins, sessions, cron scheduling, web client state)
+STORAGE_EXEMPT_MODELS = frozenset([
+    'ir.config_parameter', 'ir.logging', 'bus.bus', 'bus.presence', 'mail.presence',
+    'res.users.log', 'res.device', 'res.device.log', 'res.users.settings',
+    'ir.cron', 'ir.cron.trigger', 'ir.cron.progress',
+])
+
+# Files checked per transaction by the incremental filestore reclaim
+RECLAIM_BATCH_SIZE = 500
+RECLAIM_CRON_XMLID = 'saas_user_limit.ir_cron_saas_filestore_reclaim'
+
+# Cold tier: files compressed per cron run / per commit
+COLD_TIER_BATCH_SIZE = 200
+COLD_TIER_COMMIT_EVERY = 20
+# Keep the hot file when compression saves less than 10%
+COLD_TIER_MIN_RATIO = 0.9
+# Decompressed download copies are kept this long after their last use (seconds)
+COLD_CACHE_TTL = 24 * 3600
+# Already-compressed formats are never archived
+COLD_TIER_SKIP_MIMETYPES = [
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'video/%', 'audio/%',
+    'application/zip', 'application/gzip', 'application/x-7z-compressed',
+    'application/x-rar%', 'application/vnd.openxmlformats%',
+]
+
 
 class BaseModelStorageEnforcer(models.AbstractModel):
     """
@@ -15,48 +55,65 @@ class BaseModelStorageEnforcer(models.AbstractModel):
     """
     _inherit = 'base'
 
+    def _storage_quota_bypassed(self):
+        """
+        True inside a bypass scope: explicit context key (designated crons),
+        module data loading (install_mode) or a registry still being loaded.
+        Other root jobs (e.g. fetchmail) stay subject to the quota.
+        """
+        context = self.env.context
+        return bool(
+            context.get(STORAGE_BYPASS_KEY)
+            or context.get('install_mode')
+            or not self.env.registry.ready
+        )
+
     @api.model
     def _check_storage_quota_before_write(self):
         """Check storage quota and block if exceeded"""
-        try:
-            ICP = self.env['ir.config_parameter'].sudo()
-            readonly_mode = ICP.get_param('storage.readonly_mode', 'false')
+        with STORAGE_QUOTA_CHECK_SECONDS.time():
+            try:
+                ICP = self.env['ir.config_parameter'].sudo()
+                readonly_mode = ICP.get_param('storage.readonly_mode', 'false')
             
-            if readonly_mode == 'true':
-                quota_info = ICP.get_param('storage.quota_info', 
-                    'Storage quota exceeded. Contact administrator.')
+                if readonly_mode == 'true':
+                    STORAGE_QUOTA_CHECKS.inc(model=self._name, result='blocked')
+                    quota_info = ICP.get_param('storage.quota_info', 
+                        'Storage quota exceeded. Contact administrator.')
                 
-                raise UserError(_(
-                    "⛔ OPERATION BLOCKED\n\n"
-                    "%s\n\n"
-                    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
-                    "READ-ONLY MODE ACTIVE\n"
-                    "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
-                    "You can:\n"
-                    "✓ View records\n"
-                    "✓ Search and filter\n"
-                    "✓ Generate reports\n"
-                    "✓ Delete records (to free space)\n\n"
-                    "You CANNOT:\n"
-                    "✗ Create new records\n"
-                    "✗ Edit existing records\n"
-                    "✗ Upload files\n\n"
-                    "Contact your administrator to upgrade your storage plan."
-                ) % quota_info)
-            
-        except UserError:
-            # Re-raise UserError
-            raise
-        except Exception as e:
-            # Log error but don't block operation
-            _logger.warning("Storage quota check failed: %s", str(e))
-            pass
+                    raise UserError(_(
+                        "⛔ OPERATION BLOCKED\n\n"
+                        "%s\n\n"
+                        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+                        "READ-ONLY MODE ACTIVE\n"
+                        "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+                        "You can:\n"
+                        "✓ View records\n"
+                        "✓ Search and filter\n"
+                        "✓ Generate reports\n"
+                        "✓ Delete records (to free space)\n\n"
+                        "You CANNOT:\n"
+                        "✗ Create new records\n"
+                        "✗ Edit existing records\n"
+                        "✗ Upload files\n\n"
+                        "Contact your administrator to upgrade your storage plan."
+                    ) % quota_info)
+
+                STORAGE_QUOTA_CHECKS.inc(model=self._name, result='allowed')
+
+            except UserError:
+                # Re-raise UserError
+                raise
+            except Exception as e:
+                # Log error but don't block operation
+                _logger.warning("Storage quota check failed: %s", str(e))
+                pass
 
     @api.model_create_multi
     def create(self, vals_list):
         """Block create if quota exceeded"""
-        # Skip check for system models
-        if self._name in ['ir.config_parameter', 'ir.logging', 'bus.bus']:
+        # Skip check for system models and bypass scopes
+        if self._name in STORAGE_EXEMPT_MODELS or self._storage_quota_bypassed():
             return super().create(vals_list)
         
         self._check_storage_quota_before_write()
@@ -64,8 +121,8 @@ class BaseModelStorageEnforcer(models.AbstractModel):
 
     def write(self, vals):
         """Block write if quota exceeded"""
-        # Skip check for system models
-        if self._name in ['ir.config_parameter', 'ir.logging', 'bus.bus']:
+        # Skip check for system models and bypass scopes
+        if self._name in STORAGE_EXEMPT_MODELS or self._storage_quota_bypassed():
             return super().write(vals)
         
         self._check_storage_quota_before_write()
@@ -81,13 +138,27 @@ class IrAttachmentStorageEnforcer(models.Model):
     """Block file uploads - Most important for storage"""
     _inherit = 'ir.attachment'
 
+    @api.model
+    def _is_asset_bundle(self, vals):
+        """Asset bundles (generated JS / CSS) are framework files, not tenant data"""
+        return vals.get('res_model') == 'ir.ui.view' and (vals.get('url') or '').startswith('/web/assets/')
+
     @api.model_create_multi
     def create(self, vals_list):
         """Block file uploads if quota exceeded"""
+        if self._storage_quota_bypassed():
+            return super().create(vals_list)
+
+        if all(self._is_asset_bundle(vals) for vals in vals_list):
+            # Also skips the generic check of BaseModelStorageEnforcer
+            bypass = self.with_context(**{STORAGE_BYPASS_KEY: True})
+            return super(IrAttachmentStorageEnforcer, bypass).create(vals_list).with_env(self.env)
+
         ICP = self.env['ir.config_parameter'].sudo()
         readonly_mode = ICP.get_param('storage.readonly_mode', 'false')
         
         if readonly_mode == 'true':
+            STORAGE_QUOTA_CHECKS.inc(model=self._name, result='blocked')
             raise UserError(_(
                 "⛔ FILE UPLOAD BLOCKED\n\n"
                 "Your storage quota has been exceeded.\n"
@@ -100,6 +171,311 @@ class IrAttachmentStorageEnforcer(models.Model):
         
         return super().create(vals_list)
 
+    def write(self, vals):
+        """Asset bundles are updated by the framework (e.g. url after create)"""
+        if self and not self._storage_quota_bypassed() and all(
+            self._is_asset_bundle({'res_model': att.res_model, 'url': att.url}) for att in self.sudo()
+        ):
+            bypass = self.with_context(**{STORAGE_BYPASS_KEY: True})
+            return super(IrAttachmentStorageEnforcer, bypass).write(vals)
+        return super().write(vals)
+
+    def unlink(self):
+        """Queue the deleted files (same transaction) and wake up the reclaim job"""
+        fnames = set(self.sudo().mapped('store_fname')) - {False}
+        result = super().unlink()
+
+        if fnames and self._storage() == 'file':
+            self.env.cr.execute(
+                "INSERT INTO saas_filestore_reclaim (store_fname) SELECT unnest(%s::varchar[])",
+                [sorted(fnames)],
+            )
+            cron = self.env.ref(RECLAIM_CRON_XMLID, raise_if_not_found=False)
+            if cron:
+                # Deleting must keep working in read-only mode: that is how space is freed
+                cron.sudo().with_context(**{STORAGE_BYPASS_KEY: True})._trigger()
+        return result
+
+    @api.model
+    def _cron_reclaim_filestore(self):
+        """
+        Reclaim the queued files in bounded batches, one short transaction each,
+        instead of waiting for the periodic full filestore GC.
+        Never waits for the attachment lock: retried a minute later instead.
+        """
+        self._purge_cold_cache()
+        cr = self.env.cr
+        while True:
+            cr.execute("""
+                SELECT DISTINCT store_fname FROM saas_filestore_reclaim
+                 ORDER BY store_fname
+                 LIMIT %s
+            """, [RECLAIM_BATCH_SIZE])
+            fnames = [row[0] for row in cr.fetchall()]
+            if not fnames:
+                return True
+
+            try:
+                # Same lock as the standard GC: no concurrent insert can re-reference a file
+                with cr.savepoint(flush=False):
+                    cr.execute("LOCK ir_attachment IN SHARE MODE NOWAIT")
+            except errors.LockNotAvailable:
+                _logger.info("Reclaim: ir_attachment is busy, retrying in a minute")
+                self.env.ref(RECLAIM_CRON_XMLID).with_context(**{STORAGE_BYPASS_KEY: True})._trigger(
+                    fields.Datetime.now() + timedelta(minutes=1)
+                )
+                return False
+
+            self._reclaim_filestore_batch(fnames)
+            cr.execute("DELETE FROM saas_filestore_reclaim WHERE store_fname IN %s", [tuple(fnames)])
+            cr.commit()
+
+    @api.model
+    def _reclaim_filestore_batch(self, fnames):
+        """
+        Delete unreferenced files of the batch and update storage usage
+        (caller holds the SHARE lock on ir_attachment)
+        """
+        cr = self.env.cr
+        cr.execute("SELECT store_fname FROM ir_attachment WHERE store_fname IN %s", [tuple(fnames)])
+        referenced = {row[0] for row in cr.fetchall()}
+
+        freed = 0
+        checklist = self._full_path('checklist')
+        for fname in fnames:
+            if fname in referenced:
+                continue
+            failed = False
+            # Hot file and its compressed cold copy (if archived)
+            for full_path in (self._full_path(fname), self._cold_path(fname)):
+                try:
+                    size = os.path.getsize(full_path)
+                    os.unlink(full_path)
+                    freed += size
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    _logger.info("Reclaim: could not delete %s: %s", full_path, str(e))
+                    failed = True
+            if failed:
+                continue
+            try:
+                # Download copy of a cold file: not counted in storage usage
+                os.unlink(self._cold_cache_path(fname))
+            except OSError:
+                pass
+            try:
+                os.unlink(os.path.join(checklist, re.sub('[.]', '', fname).strip('/\\')))
+            except OSError:
+                pass
+
+        if freed:
+            _logger.info("Reclaim: %s bytes freed from %s files", freed, len(fnames) - len(referenced))
+            self.env['ir.config_parameter'].sudo()._storage_usage_freed(freed)
+        return freed
+
+
+class FilestoreReclaimQueue(models.Model):
+    """Store files released by attachment deletes, waiting for the reclaim job"""
+    _name = 'saas.filestore.reclaim'
+    _description = 'SaaS Filestore Reclaim Queue'
+    _log_access = False
+
+    store_fname = fields.Char(string='Stored Filename', required=True, index=True, readonly=True)
+
+
+# ==================== OPTIONAL: Cold Tier for Old / Large Attachments ====================
+
+class IrAttachmentColdTier(models.Model):
+    """
+    Optional archival stage: old (or large) files are gzip-compressed into
+    <filestore>/cold/ and read back transparently; only compressed bytes
+    count toward storage.usage_bytes.
+
+    Enabled with storage.cold_tier_enabled = true, thresholds:
+    storage.cold_tier_age_days (default 365), storage.cold_tier_min_size (bytes, 0 = off)
+    """
+    _inherit = 'ir.attachment'
+
+    saas_storage_tier = fields.Selection([
+        ('cold', 'Cold (compressed)'),
+        ('skip', 'Not compressible'),
+    ], string='Storage Tier', readonly=True, copy=False,
+        help='Empty: regular (hot) filestore')
+
+    saas_cold_size = fields.Integer(string='Compressed Size', readonly=True, copy=False)
+
+    @api.model
+    def _cold_path(self, fname):
+        return os.path.join(self._filestore(), 'cold', fname + '.gz')
+
+    @api.model
+    def _cold_cache_path(self, fname):
+        return os.path.join(self._filestore(), 'cold', 'cache', fname)
+
+    @api.model
+    def _cold_cache_file(self, fname):
+        """
+        Decompressed copy of a cold file for downloads: written in chunks
+        (constant memory) and reused until COLD_CACHE_TTL after its last use
+        """
+        cache_path = self._cold_cache_path(fname)
+        if os.path.exists(cache_path):
+            os.utime(cache_path)
+            return cache_path
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+        try:
+            with gzip.open(self._cold_path(fname), 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return cache_path
+
+    @api.model
+    def _purge_cold_cache(self):
+        """Delete download copies unused for COLD_CACHE_TTL"""
+        cache_dir = os.path.join(self._filestore(), 'cold', 'cache')
+        deadline = time.time() - COLD_CACHE_TTL
+        for dirpath, _dirnames, filenames in os.walk(cache_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if os.path.getmtime(path) < deadline:
+                        os.unlink(path)
+                except OSError:
+                    pass
+
+    @api.model
+    def _file_read(self, fname):
+        """Fall back to the cold copy when the hot file is gone"""
+        if not os.path.exists(self._full_path(fname)):
+            cold_path = self._cold_path(fname)
+            if os.path.exists(cold_path):
+                with gzip.open(cold_path, 'rb') as f:
+                    return f.read()
+        return super()._file_read(fname)
+
+    def _to_http_stream(self):
+        """
+        Downloads stat and stream the filestore path directly (fails for an
+        archived file): serve cold files from a decompressed copy on disk,
+        never from memory
+        """
+        self.ensure_one()
+        # Checked on disk: attachments deduplicated onto an archived file are cold too
+        if self.store_fname and not os.path.exists(self._full_path(self.store_fname)) \
+                and os.path.exists(self._cold_path(self.store_fname)):
+            path = self._cold_cache_file(self.store_fname)
+            return Stream(
+                type='path',
+                path=path,
+                mimetype=self.mimetype,
+                download_name=self.name,
+                conditional=True,
+                etag=self.checksum,
+                last_modified=self.write_date,
+                size=os.path.getsize(path),
+                public=self.public,
+            )
+        return super()._to_http_stream()
+
+    @api.model
+    def _cold_tier_candidates(self, limit):
+        """Store files whose attachments are all old enough (or large enough)"""
+        ICP = self.env['ir.config_parameter'].sudo()
+        age_days = int(ICP.get_param('storage.cold_tier_age_days', 365) or 365)
+        min_size = int(ICP.get_param('storage.cold_tier_min_size', 0) or 0)
+
+        self.env.cr.execute("""
+            SELECT store_fname, MAX(file_size)
+              FROM ir_attachment
+             WHERE store_fname IS NOT NULL
+               AND saas_storage_tier IS NULL
+               AND NOT (COALESCE(mimetype, '') LIKE ANY(%s))
+             GROUP BY store_fname
+            HAVING MAX(create_date) < (now() AT TIME ZONE 'UTC') - make_interval(days => %s)
+                OR (%s > 0 AND MAX(file_size) >= %s)
+             ORDER BY MIN(id)
+             LIMIT %s
+        """, [COLD_TIER_SKIP_MIMETYPES, age_days, min_size, min_size, limit])
+        return self.env.cr.fetchall()
+
+    @api.model
+    def _compress_to_cold(self, fname):
+        """
+        Compress one store file into the cold tier (streaming, constant memory)
+
+        :return: (tier, original_size, compressed_size)
+        """
+        full_path = self._full_path(fname)
+        cold_path = self._cold_path(fname)
+        if not os.path.exists(full_path):
+            # Already archived (deduplicated attachment) or missing: nothing to save
+            if os.path.exists(cold_path):
+                cold_size = os.path.getsize(cold_path)
+                return 'cold', cold_size, cold_size
+            return 'skip', 0, 0
+        os.makedirs(os.path.dirname(cold_path), exist_ok=True)
+
+        tmp_path = cold_path + '.tmp'
+        with open(full_path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        original_size = os.path.getsize(full_path)
+        compressed_size = os.path.getsize(tmp_path)
+
+        if compressed_size >= original_size * COLD_TIER_MIN_RATIO:
+            os.unlink(tmp_path)
+            return 'skip', original_size, original_size
+
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, cold_path)
+        # Reads fall back to the cold copy as soon as the hot file is gone
+        os.unlink(full_path)
+        return 'cold', original_size, compressed_size
+
+    @api.model
+    def _cron_archive_cold_attachments(self):
+        """Bounded background batch: compress candidates and release quota"""
+        self._purge_cold_cache()
+        ICP = self.env['ir.config_parameter'].sudo()
+        if ICP.get_param('storage.cold_tier_enabled', 'false') != 'true' or self._storage() != 'file':
+            return False
+
+        saved = 0
+        processed = 0
+        for fname, _file_size in self._cold_tier_candidates(COLD_TIER_BATCH_SIZE):
+            try:
+                tier, original_size, compressed_size = self._compress_to_cold(fname)
+            except OSError as e:
+                # Marked as well, otherwise it comes back in every batch
+                _logger.warning("Cold tier: could not compress %s: %s", fname, str(e))
+                tier, original_size, compressed_size = 'skip', 0, 0
+
+            self.env.cr.execute("""
+                UPDATE ir_attachment
+                   SET saas_storage_tier = %s, saas_cold_size = %s
+                 WHERE store_fname = %s
+            """, [tier, compressed_size if tier == 'cold' else None, fname])
+            saved += original_size - compressed_size
+            processed += 1
+
+            if processed % COLD_TIER_COMMIT_EVERY == 0:
+                if saved:
+                    ICP._storage_usage_freed(saved)
+                    saved = 0
+                self.env.cr.commit()
+
+        if saved:
+            ICP._storage_usage_freed(saved)
+        self.invalidate_model(['saas_storage_tier', 'saas_cold_size'])
+        _logger.info("❄️ Cold tier: %s files processed", processed)
+        return True
+
 
 # ==================== OPTIONAL: Mail Message Enforcement ====================
 # Only if 'mail' module is installed
@@ -114,12 +490,16 @@ try:
         @api.model_create_multi
         def create(self, vals_list):
             """Block messages with attachments if quota exceeded"""
+            if self._storage_quota_bypassed():
+                return super().create(vals_list)
+
             ICP = self.env['ir.config_parameter'].sudo()
             readonly_mode = ICP.get_param('storage.readonly_mode', 'false')
             
             if readonly_mode == 'true':
                 for vals in vals_list:
                     if vals.get('attachment_ids'):
+                        STORAGE_QUOTA_CHECKS.inc(model=self._name, result='blocked')
                         raise UserError(_(
                             "⛔ CANNOT SEND MESSAGE WITH ATTACHMENTS\n\n"
                             "Storage quota exceeded.\n"
@@ -158,3 +538,104 @@ class ResUsers(models.Model):
             _logger.error("Error checking readonly mode on login: %s", str(e))
         
         return result
+
+
+class IrCronStorageBypass(models.Model):
+    """Designated system jobs run inside the storage quota bypass scope"""
+    _inherit = 'ir.cron'
+
+    saas_storage_bypass = fields.Boolean(
+        string='Bypass Storage Quota',
+        help='Run this job without storage quota checks (system jobs only)'
+    )
+
+    def _callback(self, cron_name, server_action_id, *args):
+        # Scheduling records (ir.cron.progress / trigger) are exempt models:
+        # only the job code itself needs the bypass scope
+        cron = self.with_context(**{STORAGE_BYPASS_KEY: True}) if self.sudo().saas_storage_bypass else self
+        return super(IrCronStorageBypass, cron)._callback(cron_name, server_action_id, *args)
+
+
+# ==================== Read-only State for the Web Client ====================
+
+STORAGE_STATE_KEYS = ('storage.readonly_mode', 'storage.quota_info')
+STORAGE_BUS_NOTIFICATION = 'saas_storage_quota/updated'
+
+
+class IrConfigParameterStorageState(models.Model):
+    """Push read-only state changes to connected clients over the bus"""
+    _inherit = 'ir.config_parameter'
+
+    @api.model
+    def _get_storage_remaining(self):
+        """
+        Remaining quota in bytes, 0 in read-only mode,
+        None when no byte quota is configured (storage.quota_bytes)
+        """
+        if self.get_param('storage.readonly_mode', 'false') == 'true':
+            return 0
+        quota = int(self.get_param('storage.quota_bytes', 0) or 0)
+        if not quota:
+            return None
+        usage = int(self.get_param('storage.usage_bytes', 0) or 0)
+        return max(0, quota - usage)
+
+    @api.model
+    def _storage_usage_freed(self, freed):
+        """
+        Lower storage.usage_bytes right away (atomic update) and leave
+        read-only mode as soon as usage is back under storage.quota_bytes
+        """
+        self.env.cr.execute(r"""
+            UPDATE ir_config_parameter
+               SET value = GREATEST(0, value::bigint - %s)::text
+             WHERE key = 'storage.usage_bytes' AND value ~ '^\d+$'
+         RETURNING value::bigint
+        """, [freed])
+        row = self.env.cr.fetchone()
+        if not row:
+            return
+        self.invalidate_model()
+        self.env.registry.clear_cache()
+
+        usage = row[0]
+        quota = int(self.get_param('storage.quota_bytes', 0) or 0)
+        if quota and usage < quota and self.get_param('storage.readonly_mode', 'false') == 'true':
+            self.set_param('storage.readonly_mode', 'false')
+            _logger.info("Storage usage back under quota (%s/%s bytes): read-only mode cleared", usage, quota)
+
+    @api.model
+    def _get_storage_state(self):
+        return {
+            'storage_readonly_mode': self.get_param('storage.readonly_mode', 'false') == 'true',
+            'storage_quota_info': self.get_param('storage.quota_info', ''),
+        }
+
+    def _notify_storage_state(self):
+        """Send the new state to every internal user (group channel)"""
+        self.env['bus.bus']._sendone(
+            self.env.ref('base.group_user'),
+            STORAGE_BUS_NOTIFICATION,
+            self.sudo()._get_storage_state(),
+        )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        if any(vals.get('key') in STORAGE_STATE_KEYS for vals in vals_list):
+            self._notify_storage_state()
+        return records
+
+    def write(self, vals):
+        changed = any(key in STORAGE_STATE_KEYS for key in self.mapped('key') + [vals.get('key')])
+        result = super().write(vals)
+        if changed:
+            self._notify_storage_state()
+        return result
+
+    def unlink(self):
+        changed = any(key in STORAGE_STATE_KEYS for key in self.mapped('key'))
+        result = super().unlink()
+        if changed:
+            self._notify_storage_state()
+        return result
@@ -5,6 +5,8 @@ import logging
 
 _logger = logging.getLogger(__name__)
 
+USER_LIMIT_BUS_NOTIFICATION = 'saas_user_limit/updated'
+
 
 class UserLimitControl(models.Model):
     """
@@ -66,6 +68,14 @@ class UserLimitControl(models.Model):
         readonly=True
     )
 
+    scope = fields.Selection([
+        ('database', 'Whole Database'),
+        ('company', 'Company'),
+    ], string='Scope', default='database', required=True, readonly=True,
+        help='Whole Database: limit all internal users.\n'
+             'Company: limit internal users whose default company is the record company.'
+    )
+
     @api.depends('name')
     def _compute_display_name(self):
         """حساب اسم العرض"""
@@ -75,11 +85,20 @@ class UserLimitControl(models.Model):
     @api.depends('max_users')
     def _compute_current_users_count(self):
         """حساب عدد المستخدمين الحاليين (بدون shared users)"""
+        company_records = self.filtered(lambda r: r.scope == 'company')
+        company_counts = self._count_internal_users_by_company(company_records.company_id.ids)
+        database_count = None
+
         for rec in self:
-            rec.current_users_count = self.env['res.users'].search_count([
-                ('share', '=', False),  # مستخدمين داخليين فقط
-                ('active', '=', True)
-            ])
+            if rec.scope == 'company':
+                rec.current_users_count = company_counts.get(rec.company_id.id, 0)
+                continue
+            if database_count is None:
+                database_count = self.env['res.users'].search_count([
+                    ('share', '=', False),  # مستخدمين داخليين فقط
+                    ('active', '=', True)
+                ])
+            rec.current_users_count = database_count
 
     @api.depends('max_users', 'current_users_count')
     def _compute_remaining_users(self):
@@ -96,15 +115,30 @@ class UserLimitControl(models.Model):
     @api.model_create_multi
     def create(self, vals_list):
         """
-        منع إنشاء أكثر من سجل واحد
+        منع إنشاء أكثر من سجل واحد لقاعدة البيانات أو لنفس الشركة
         Odoo 18 uses create_multi by default
         """
         existing = self.search([])
-        if existing:
-            raise ValidationError(_(
-                'Only one User Limit Control record is allowed per database!\n'
-                'Please update the existing record instead.'
-            ))
+        has_database_limit = any(rec.scope == 'database' for rec in existing)
+        limited_companies = set(existing.filtered(lambda r: r.scope == 'company').company_id.ids)
+
+        for vals in vals_list:
+            if vals.get('scope', 'database') == 'database':
+                if has_database_limit:
+                    raise ValidationError(_(
+                        'Only one User Limit Control record is allowed per database!\n'
+                        'Please update the existing record instead.'
+                    ))
+                has_database_limit = True
+                continue
+
+            company_id = vals.get('company_id') or self.env.company.id
+            if company_id in limited_companies:
+                raise ValidationError(_(
+                    'Only one User Limit Control record is allowed per company!\n'
+                    'Please update the existing record instead.'
+                ))
+            limited_companies.add(company_id)
 
         records = super().create(vals_list)
 
@@ -114,6 +148,9 @@ class UserLimitControl(models.Model):
                 record.max_users
             )
 
+        if any(record.scope == 'database' for record in records):
+            self._notify_user_limit_state()
+
         return records
 
     def write(self, vals):
@@ -122,7 +159,7 @@ class UserLimitControl(models.Model):
         منع تعديل الحقول الأساسية
         """
         # منع تعديل بعض الحقول
-        protected_fields = ['name', 'active', 'company_id']
+        protected_fields = ['name', 'active', 'company_id', 'scope']
         for field in protected_fields:
             if field in vals and field != 'max_users':
                 vals.pop(field)
@@ -138,6 +175,8 @@ class UserLimitControl(models.Model):
                 "✅ User limit updated to: %s",
                 vals['max_users']
             )
+            if any(rec.scope == 'database' for rec in self):
+                self._notify_user_limit_state()
 
         return result
 
@@ -149,13 +188,109 @@ class UserLimitControl(models.Model):
             'If you need to change the user limit, please update the "Maximum Users" field instead.'
         ))
 
+    @api.model
+    def _get_database_limit(self):
+        """سجل الحد الخاص بقاعدة البيانات كاملة"""
+        return self.search([('scope', '=', 'database')], limit=1)
+
+    @api.model
+    def _count_internal_users_by_company(self, company_ids):
+        """
+        عدد المستخدمين الداخليين النشطين لكل شركة - استعلام GROUP BY واحد
+
+        :param company_ids: الشركات المطلوب عدها
+        :return: dict {company_id: count}
+        """
+        if not company_ids:
+            return {}
+
+        groups = self.env['res.users'].sudo()._read_group([
+            ('share', '=', False),
+            ('active', '=', True),
+            ('company_id', 'in', list(company_ids)),
+        ], ['company_id'], ['__count'])
+        return {company.id: count for company, count in groups}
+
+    @api.model
+    def _check_company_limits(self, added_by_company=None, company_ids=None):
+        """
+        فحص حدود الشركات المتأثرة فقط
+
+        :param added_by_company: dict {company_id: عدد المستخدمين الجدد} (قبل الإنشاء)
+        :param company_ids: شركات تم تعديل مستخدميها (بعد الكتابة)
+        """
+        added_by_company = added_by_company or {}
+        affected = set(added_by_company) | set(company_ids or ())
+        if not affected:
+            return True
+
+        limits = self.search([('scope', '=', 'company'), ('company_id', 'in', list(affected))])
+        if not limits:
+            return True
+
+        counts = self._count_internal_users_by_company(limits.company_id.ids)
+        for limit in limits:
+            company = limit.company_id
+            current_count = counts.get(company.id, 0)
+            new_total = current_count + added_by_company.get(company.id, 0)
+            if new_total > limit.max_users:
+                raise ValidationError(_(
+                    '🚫 Cannot Save User - Company Limit Reached!\n\n'
+                    '🏢 Company: %s\n'
+                    'Maximum Allowed Users: %s\n'
+                    'Would Result In: %s users\n\n'
+                    '💡 Solution:\n'
+                    'Contact your system administrator to increase the company user limit.'
+                ) % (company.name, limit.max_users, new_total))
+
+        return True
+
+    @api.model
+    def _get_user_limit_state(self, current_count=None):
+        """
+        حالة الحد لواجهة المستخدم (session_info / bus)
+
+        :param current_count: عدد المستخدمين إن كان معروفاً مسبقاً (لتجنب استعلام إضافي)
+        """
+        control = self._get_database_limit()
+        # الواجهة تمنع فقط إنشاء المستخدمين الداخليين (مجموعة base.group_user)
+        internal_group_id = self.env.ref('base.group_user').id
+        if not control:
+            return {
+                'max_users': False,
+                'current_users': current_count,
+                'limit_reached': False,
+                'internal_group_id': internal_group_id,
+            }
+
+        if current_count is None:
+            current_count = self.env['res.users'].search_count([
+                ('share', '=', False),
+                ('active', '=', True)
+            ])
+        return {
+            'max_users': control.max_users,
+            'current_users': current_count,
+            'limit_reached': current_count >= control.max_users,
+            'internal_group_id': internal_group_id,
+        }
+
+    @api.model
+    def _notify_user_limit_state(self, current_count=None):
+        """إرسال حالة الحد لمديري المستخدمين المتصلين عبر bus.bus"""
+        self.env['bus.bus']._sendone(
+            self.env.ref('base.group_erp_manager'),
+            USER_LIMIT_BUS_NOTIFICATION,
+            self._get_user_limit_state(current_count),
+        )
+
     @api.model
     def get_user_limit(self):
         """
         الحصول على الحد الأقصى للمستخدمين
         دالة مساعدة للاستخدام في أماكن أخرى
         """
-        control = self.search([], limit=1)
+        control = self._get_database_limit()
         return control.max_users if control else 1
 
     @api.model
@@ -169,7 +304,7 @@ class UserLimitControl(models.Model):
         Returns:
             bool: True إذا لم يتم تجاوز الحد، False خلاف ذلك
         """
-        control = self.search([], limit=1)
+        control = self._get_database_limit()
 
         if not control:
             _logger.warning("⚠️ No user limit control found!")
@@ -194,25 +329,32 @@ class UserLimitControl(models.Model):
         return True
 
     @api.model
-    def update_limit_from_saas(self, new_limit):
+    def update_limit_from_saas(self, new_limit, company_id=False):
         """
         تحديث الحد من نظام SaaS الرئيسي
         يتم استدعاؤها من saas.subscription
 
         Args:
             new_limit (int): الحد الجديد
+            company_id (int): الشركة (اختياري) - بدونها يتم تحديث حد قاعدة البيانات
 
         Returns:
             bool: True إذا تم التحديث بنجاح
         """
-        control = self.search([], limit=1)
+        if company_id:
+            control = self.search([('scope', '=', 'company'), ('company_id', '=', company_id)], limit=1)
+        else:
+            control = self._get_database_limit()
 
         if not control:
             # إنشاء سجل جديد إذا لم يكن موجوداً
-            control = self.create({
+            vals = {
                 'name': 'User Limit Control',
                 'max_users': new_limit
-            })
+            }
+            if company_id:
+                vals.update({'scope': 'company', 'company_id': company_id})
+            control = self.create(vals)
             _logger.info("✅ User limit control created with limit: %s", new_limit)
         else:
             control.max_users = new_limit
@@ -224,11 +366,15 @@ class UserLimitControl(models.Model):
         """عرض المستخدمين الحاليين"""
         self.ensure_one()
 
+        domain = [('share', '=', False), ('active', '=', True)]
+        if self.scope == 'company':
+            domain.append(('company_id', '=', self.company_id.id))
+
         return {
             'name': _('Internal Users'),
             'type': 'ir.actions.act_window',
             'res_model': 'res.users',
             'view_mode': 'list,form',
-            'domain': [('share', '=', False), ('active', '=', True)],
+            'domain': domain,
             'context': {'create': False},  # منع الإنشاء من هذه الشاشة
         }
\ No newline at end of file
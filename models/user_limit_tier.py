@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class UserLimitTier(models.Model):
+    """
+    حد أقصى للمستخدمين لكل مجموعة (شريحة ترخيص)
+    مثال: Full Users / Light Users / مجموعة تطبيق معين
+    """
+    _name = 'saas.user.limit.tier'
+    _description = 'SaaS User Limit Tier'
+    _order = 'sequence, id'
+
+    name = fields.Char(
+        string='Tier',
+        required=True
+    )
+
+    sequence = fields.Integer(
+        string='Sequence',
+        default=10
+    )
+
+    group_id = fields.Many2one(
+        'res.groups',
+        string='Group',
+        required=True,
+        ondelete='cascade',
+        help='Internal users belonging to this group count toward the tier limit'
+    )
+
+    max_users = fields.Integer(
+        string='Maximum Users',
+        default=1,
+        required=True
+    )
+
+    current_users_count = fields.Integer(
+        string='Current Users',
+        compute='_compute_current_users_count',
+        store=False
+    )
+
+    _sql_constraints = [
+        ('group_uniq', 'unique(group_id)', 'Only one user limit tier is allowed per group!'),
+    ]
+
+    def _compute_current_users_count(self):
+        """حساب عدد المستخدمين لكل الشرائح في استعلام واحد"""
+        counts = self._count_internal_users_by_group(self.group_id.ids)
+        for rec in self:
+            rec.current_users_count = counts.get(rec.group_id.id, 0)
+
+    @api.model
+    def _count_internal_users_by_group(self, group_ids, user_ids=None):
+        """
+        عدد المستخدمين الداخليين النشطين لكل مجموعة - استعلام GROUP BY واحد
+
+        :param group_ids: المجموعات المطلوب عدها
+        :param user_ids: إن وُجدت، يتم عد المجموعات التي ينتمي لها هؤلاء المستخدمين فقط
+        :return: dict {group_id: count}
+        """
+        if not group_ids:
+            return {}
+
+        self.env['res.users'].flush_model(['active', 'share', 'groups_id'])
+
+        query = """
+            SELECT r.gid, COUNT(*)
+              FROM res_groups_users_rel r
+              JOIN res_users u ON u.id = r.uid
+             WHERE r.gid IN %s
+               AND u.active
+               AND u.share IS NOT TRUE
+        """
+        params = [tuple(group_ids)]
+        if user_ids:
+            query += " AND r.gid IN (SELECT gid FROM res_groups_users_rel WHERE uid IN %s)"
+            params.append(tuple(user_ids))
+        query += " GROUP BY r.gid"
+
+        self.env.cr.execute(query, params)
+        return dict(self.env.cr.fetchall())
+
+    @api.model
+    def _get_tier_memberships(self, users):
+        """
+        عضويات المستخدمين الداخليين النشطين في مجموعات الشرائح
+
+        :return: set of (user_id, group_id)
+        """
+        group_ids = self.search([]).group_id.ids
+        if not group_ids or not users:
+            return set()
+
+        self.env['res.users'].flush_model(['active', 'share', 'groups_id'])
+        self.env.cr.execute("""
+            SELECT r.uid, r.gid
+              FROM res_groups_users_rel r
+              JOIN res_users u ON u.id = r.uid
+             WHERE r.uid IN %s
+               AND r.gid IN %s
+               AND u.active
+               AND u.share IS NOT TRUE
+        """, [tuple(users.ids), tuple(group_ids)])
+        return set(self.env.cr.fetchall())
+
+    @api.model
+    def _check_tier_limits(self, users, group_ids=None):
+        """
+        فحص حدود الشرائح للمستخدمين الذين تم إنشاؤهم / تعديلهم
+        عدد الاستعلامات ثابت مهما زاد عدد الشرائح
+
+        :param group_ids: إن وُجدت، يتم فحص هذه المجموعات فقط (التي زاد عددها)
+        """
+        tiers = self.search([])
+        if not tiers or not users:
+            return True
+
+        tier_by_group = {tier.group_id.id: tier for tier in tiers}
+        if group_ids is None:
+            counts = self._count_internal_users_by_group(list(tier_by_group), users.ids)
+        else:
+            counts = self._count_internal_users_by_group(
+                [group_id for group_id in group_ids if group_id in tier_by_group]
+            )
+
+        for group_id, count in counts.items():
+            tier = tier_by_group[group_id]
+            if count > tier.max_users:
+                raise ValidationError(_(
+                    '🚫 User Limit Reached for Tier "%s"!\n\n'
+                    'Maximum Allowed Users: %s\n'
+                    'Current Users: %s\n\n'
+                    '💡 Solution:\n'
+                    'Contact your system administrator to increase the tier limit.'
+                ) % (tier.name, tier.max_users, count))
+
+        return True
+
+    @api.model
+    def update_tiers_from_saas(self, tiers):
+        """
+        تحديث حدود الشرائح من نظام SaaS الرئيسي
+
+        Args:
+            tiers (list): [{'group': 'base.group_user' أو group_id, 'max_users': 10, 'name': 'Full Users'}]
+
+        Returns:
+            bool: True إذا تم التحديث بنجاح
+        """
+        existing = {tier.group_id.id: tier for tier in self.search([])}
+
+        for tier_vals in tiers:
+            group = tier_vals['group']
+            group_id = self.env.ref(group).id if isinstance(group, str) else int(group)
+
+            tier = existing.get(group_id)
+            if tier:
+                tier.max_users = tier_vals['max_users']
+            else:
+                self.create({
+                    'name': tier_vals.get('name') or self.env['res.groups'].browse(group_id).name,
+                    'group_id': group_id,
+                    'max_users': tier_vals['max_users'],
+                })
+
+        _logger.info("✅ User limit tiers updated: %s", len(tiers))
+        return True
@@ -0,0 +1,141 @@
+/** @odoo-module **/
+
+import { _t } from "@web/core/l10n/translation";
+import { RPCError } from "@web/core/network/rpc";
+import { ORM } from "@web/core/orm_service";
+import { registry } from "@web/core/registry";
+import { session } from "@web/session";
+import { patch } from "@web/core/utils/patch";
+import { storageState } from "./storage_quota_banner";
+
+// Same exemptions as BaseModelStorageEnforcer on the server
+const STORAGE_EXEMPT_MODELS = new Set([
+    "ir.config_parameter",
+    "ir.logging",
+    "bus.bus",
+    "bus.presence",
+    "mail.presence",
+    "res.users.log",
+    "res.device",
+    "res.device.log",
+    "res.users.settings",
+    "ir.cron",
+    "ir.cron.trigger",
+    "ir.cron.progress",
+]);
+const WRITE_METHODS = new Set(["create", "write", "web_save"]);
+
+/**
+ * Current user limit state (only sent to user managers).
+ */
+export const userLimitState = {
+    limitReached: false,
+    maxUsers: false,
+    internalGroupId: false,
+};
+
+export const userLimitService = {
+    dependencies: ["bus_service"],
+
+    start(env, { bus_service }) {
+        const apply = (state) => {
+            userLimitState.limitReached = Boolean(state && state.limit_reached);
+            userLimitState.maxUsers = state ? state.max_users : false;
+            userLimitState.internalGroupId = state ? state.internal_group_id : false;
+        };
+
+        apply(session.saas_user_limit);
+        bus_service.subscribe("saas_user_limit/updated", apply);
+    },
+};
+
+registry.category("services").add("saas_user_limit", userLimitService);
+
+function userError(message) {
+    const error = new RPCError(message);
+    error.exceptionName = "odoo.exceptions.UserError";
+    error.data = {
+        name: "odoo.exceptions.UserError",
+        message,
+        arguments: [message],
+        debug: "",
+    };
+    return error;
+}
+
+/**
+ * Values of the new res.users records of a create / web_save call (none for updates).
+ */
+function newRecordValues(method, args) {
+    if (method === "create") {
+        return [].concat(args[0] || []);
+    }
+    if (method === "web_save" && !(args[0] && args[0].length)) {
+        return [args[1] || {}];
+    }
+    return [];
+}
+
+function hasGroupCommand(commands, groupId) {
+    return (
+        Array.isArray(commands) &&
+        commands.some(
+            (command) =>
+                (command[0] === 4 && command[1] === groupId) ||
+                (command[0] === 6 && (command[2] || []).includes(groupId))
+        )
+    );
+}
+
+/**
+ * Only values that explicitly make an internal user: portal / public users
+ * and anything ambiguous are left to the server.
+ */
+function isInternalUser(vals, internalGroupId) {
+    if ("share" in vals) {
+        return !vals.share;
+    }
+    if (!internalGroupId) {
+        return false;
+    }
+    return Object.entries(vals).some(
+        ([field, value]) =>
+            (field.startsWith("sel_groups_") && value === internalGroupId) ||
+            (field === `in_group_${internalGroupId}` && value === true) ||
+            (field === "groups_id" && hasGroupCommand(value, internalGroupId))
+    );
+}
+
+/**
+ * Reject writes the server would refuse anyway, before sending the request.
+ */
+patch(ORM.prototype, {
+    call(model, method, args = [], kwargs = {}) {
+        if (WRITE_METHODS.has(method)) {
+            if (storageState.readonly && !STORAGE_EXEMPT_MODELS.has(model)) {
+                return Promise.reject(
+                    userError(
+                        _t("⛔ OPERATION BLOCKED\n\n%s\n\nREAD-ONLY MODE ACTIVE", storageState.info)
+                    )
+                );
+            }
+            if (
+                model === "res.users" &&
+                userLimitState.limitReached &&
+                newRecordValues(method, args).some((vals) =>
+                    isInternalUser(vals, userLimitState.internalGroupId)
+                )
+            ) {
+                return Promise.reject(
+                    userError(
+                        _t(
+                            "🚫 Cannot Create User - Limit Reached!\n\nMaximum Allowed Users: %s",
+                            userLimitState.maxUsers
+                        )
+                    )
+                );
+            }
+        }
+        return super.call(model, method, args, kwargs);
+    },
+});
@@ -0,0 +1,39 @@
+/** @odoo-module **/
+
+import { registry } from "@web/core/registry";
+import { session } from "@web/session";
+
+/**
+ * Current read-only state, shared with the write guard.
+ */
+export const storageState = {
+    readonly: false,
+    info: "",
+};
+
+/**
+ * Read-only banner: initial state comes from session_info,
+ * updates are pushed over the bus (no RPC on page load).
+ */
+export const storageQuotaService = {
+    dependencies: ["bus_service"],
+
+    start(env, { bus_service }) {
+        const apply = ({ storage_readonly_mode, storage_quota_info }) => {
+            storageState.readonly = Boolean(storage_readonly_mode);
+            storageState.info = storage_quota_info || "";
+            if (storageState.readonly) {
+                document.body.setAttribute("data-readonly-mode", "true");
+                document.body.setAttribute("data-readonly-info", storageState.info);
+            } else {
+                document.body.removeAttribute("data-readonly-mode");
+                document.body.removeAttribute("data-readonly-info");
+            }
+        };
+
+        apply(session);
+        bus_service.subscribe("saas_storage_quota/updated", apply);
+    },
+};
+
+registry.category("services").add("saas_storage_quota", storageQuotaService);